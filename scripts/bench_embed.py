@@ -0,0 +1,78 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from gensim.models import KeyedVectors
+
+from src.ml.dataset import EMBED_DIM, embed_batch, embed_news
+
+DEFAULT_PARQUET = Path("data/processed/test.parquet")
+DEFAULT_W2V = Path("models/word2vec.kv")
+
+
+def load_texts(parquet_path: Path) -> list[str]:
+    df = pd.read_parquet(parquet_path, columns=["text_sequence"])
+    return [t for seq in df["text_sequence"] if seq is not None for t in seq]
+
+
+def synthetic_kv(texts: list[str], seed: int = 0) -> KeyedVectors:
+    # без models/word2vec.kv: словарь из корпуса, ~половина токенов OOV
+    vocab = sorted({tok for t in texts for tok in t.split()})[::2]
+    kv = KeyedVectors(EMBED_DIM)
+    rng = np.random.default_rng(seed)
+    kv.add_vectors(vocab, rng.standard_normal((len(vocab), EMBED_DIM)).astype(np.float32))
+    return kv
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Бенчмарк embed_news (по одному) vs embed_batch.")
+    p.add_argument("--parquet", type=Path, default=DEFAULT_PARQUET)
+    p.add_argument("--w2v", type=Path, default=DEFAULT_W2V)
+    p.add_argument("--copies", type=int, default=20, help="размножить корпус N раз")
+    p.add_argument("--repeat", type=int, default=5)
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    texts = load_texts(args.parquet) * args.copies
+    if args.w2v.exists():
+        kv = KeyedVectors.load(str(args.w2v))
+        print(f"W2V: {args.w2v} ({len(kv):,} слов)")
+    else:
+        kv = synthetic_kv(texts)
+        print(f"W2V: синтетический ({len(kv):,} слов) — {args.w2v} не найден")
+    n_tokens = sum(len(t.split()) for t in texts)
+    print(f"Документов: {len(texts):,}, токенов: {n_tokens:,}\n")
+
+    ref = np.stack([embed_news(t, kv) for t in texts])
+    out = embed_batch(texts, kv)
+    if ref.dtype != out.dtype or not np.array_equal(ref, out):
+        raise SystemExit(f"Расхождение: max|Δ|={np.abs(ref - out).max():.3e}")
+    print("Выход совпадает побитово (float32)\n")
+
+    for batch in (1, 50, len(texts)):
+        chunks = [texts[i:i + batch] for i in range(0, len(texts), batch)]
+        t_loop = best_of(lambda: [embed_news(t, kv) for t in texts], args.repeat)
+        t_batch = best_of(
+            lambda chunks=chunks: [embed_batch(c, kv) for c in chunks], args.repeat,
+        )
+        print(
+            f"batch={batch:6d}  embed_news: {t_loop * 1e3:8.1f} ms  "
+            f"embed_batch: {t_batch * 1e3:8.1f} ms  ×{t_loop / t_batch:5.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
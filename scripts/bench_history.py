@@ -0,0 +1,90 @@
+import argparse
+import statistics
+import time
+
+import httpx
+
+from src.config import settings
+from src.inference.cache import PredictionCache
+from src.inference.keys import cache_keys
+from src.inference.worker import _latest_valid_dts
+from src.storage.db import prediction_by_dt, predictions_by_dts, session_scope
+
+
+def lookup_per_dt(cache: PredictionCache, dts, keys) -> int:
+    # как /history работал раньше: GET и отдельная транзакция на каждый dt
+    found = 0
+    for dt, key in zip(dts, keys, strict=True):
+        if cache.get(key) is not None:
+            found += 1
+            continue
+        with session_scope() as session:
+            if prediction_by_dt(session, dt) is not None:
+                found += 1
+    return found
+
+
+def lookup_bulk(cache: PredictionCache, dts, keys) -> int:
+    cached = cache.get_many(keys)
+    rest = [dt for dt, key in zip(dts, keys, strict=True) if key not in cached]
+    with session_scope() as session:
+        rows = predictions_by_dts(session, rest)
+    return len(cached) + len(rows)
+
+
+def timed(fn, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> float:
+    timings = sorted(timings)
+    p50 = statistics.median(timings)
+    p95 = timings[int(0.95 * (len(timings) - 1))]
+    print(f"{name:14s} p50={p50 * 1e3:7.2f} ms  p95={p95 * 1e3:7.2f} ms")
+    return p50
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Бенчмарк lookup'ов /history: по одному vs bulk.")
+    p.add_argument("--k", type=int, default=50)
+    p.add_argument("--repeat", type=int, default=50)
+    p.add_argument(
+        "--api-url", default=None, help=f"ещё и end-to-end /history, напр. {settings.api_url}",
+    )
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    cache = PredictionCache()
+    dts = _latest_valid_dts(args.k)
+    # версия — та, что опубликовал predict-worker, как в API
+    keys = cache_keys(dts, cache.model_version())
+    print(f"k={len(dts)}, Redis: {'да' if cache.available else 'нет'}")
+    print(
+        f"найдено: по одному={lookup_per_dt(cache, dts, keys)}, "
+        f"bulk={lookup_bulk(cache, dts, keys)}\n"
+    )
+
+    # до: GET и транзакция на каждый dt; после: один MGET и один запрос в predictions
+    before = report("по одному", timed(lambda: lookup_per_dt(cache, dts, keys), args.repeat))
+    after = report("bulk", timed(lambda: lookup_bulk(cache, dts, keys), args.repeat))
+    print(f"до → после (p50): {before * 1e3:.2f} → {after * 1e3:.2f} ms, ×{before / after:.1f}")
+
+    if args.api_url:
+        with httpx.Client(timeout=120.0) as client:
+            url = f"{args.api_url}/history"
+            client.get(url, params={"k": args.k}).raise_for_status()  # прогрев
+            def request() -> None:
+                client.get(url, params={"k": args.k}).raise_for_status()
+
+            report("GET /history", timed(request, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
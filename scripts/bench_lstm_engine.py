@@ -0,0 +1,110 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from src.inference.worker import DROPOUT, HIDDEN_SIZE, NUM_LAYERS
+from src.ml.dataset import EMBED_DIM, NUMERIC_DIM
+from src.ml.lstm import NewsLSTM
+from src.ml.lstm_numpy import NumpyNewsLSTM, export_npz
+
+DEFAULT_LSTM = Path("models/lstm_best.pt")
+TOLERANCE = 1e-6
+
+
+def torch_model(lstm_path: Path) -> NewsLSTM:
+    model = NewsLSTM(
+        embed_dim=EMBED_DIM,
+        hidden_size=HIDDEN_SIZE,
+        num_layers=NUM_LAYERS,
+        num_numeric=NUMERIC_DIM,
+        dropout=DROPOUT,
+    )
+    if lstm_path.exists():
+        model.load_state_dict(torch.load(lstm_path, map_location="cpu"))
+    return model.eval()
+
+
+def random_batch(rng: np.random.Generator, batch: int, max_len: int):
+    lengths = rng.integers(0, max_len + 1, size=batch)
+    text = np.zeros((batch, max(1, max_len), EMBED_DIM), dtype=np.float32)
+    for b, n in enumerate(lengths):
+        text[b, :n] = rng.standard_normal((n, EMBED_DIM)).astype(np.float32) * 0.1
+    numeric = rng.standard_normal((batch, NUMERIC_DIM)).astype(np.float32)
+    return text, lengths, numeric
+
+
+def torch_forward(model: NewsLSTM, text, lengths, numeric) -> np.ndarray:
+    with torch.no_grad():
+        return model(
+            torch.from_numpy(text), torch.from_numpy(lengths), torch.from_numpy(numeric)
+        ).numpy()
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Паритет и скорость NewsLSTM: torch vs NumPy.")
+    p.add_argument("--lstm", type=Path, default=DEFAULT_LSTM)
+    p.add_argument("--export-npz", action="store_true", help="сохранить веса рядом в .npz")
+    p.add_argument("--repeat", type=int, default=50)
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    torch.set_num_threads(1)
+    model = torch_model(args.lstm)
+    source = args.lstm if args.lstm.exists() else "случайные веса"
+    engine = NumpyNewsLSTM.from_state_dict(
+        {k: v.numpy() for k, v in model.state_dict().items()}
+    )
+    print(f"Веса: {source}\n")
+
+    rng = np.random.default_rng(args.seed)
+    worst = 0.0
+    for batch, max_len in ((1, 0), (1, 1), (1, 50), (16, 50), (51, 49)):
+        text, lengths, numeric = random_batch(rng, batch, max_len)
+        ref = torch_forward(model, text, lengths, numeric)
+        out = engine(text, lengths, numeric)
+        worst = max(worst, float(np.abs(ref - out).max()))
+    if worst > TOLERANCE:
+        raise SystemExit(f"Расхождение: max|Δ|={worst:.3e} > {TOLERANCE:.0e}")
+    print(f"Паритет с torch: max|Δ|={worst:.3e} ≤ {TOLERANCE:.0e}\n")
+
+    for batch, max_len in ((1, 0), (1, 50), (16, 50)):
+        text, lengths, numeric = random_batch(rng, batch, max_len)
+        lengths[:] = max_len
+        t_torch = best_of(
+            lambda text=text, lengths=lengths, numeric=numeric: torch_forward(
+                model, text, lengths, numeric,
+            ),
+            args.repeat,
+        )
+        t_np = best_of(
+            lambda text=text, lengths=lengths, numeric=numeric: engine(text, lengths, numeric),
+            args.repeat,
+        )
+        print(
+            f"batch={batch:3d} len={max_len:3d}  torch: {t_torch * 1e3:7.2f} ms  "
+            f"numpy: {t_np * 1e3:7.2f} ms  ×{t_torch / t_np:5.1f}"
+        )
+
+    if args.export_npz and args.lstm.exists():
+        npz_path = args.lstm.with_suffix(".npz")
+        export_npz(args.lstm, npz_path)
+        print(f"\nСохранено: {npz_path}")
+
+
+if __name__ == "__main__":
+    main()
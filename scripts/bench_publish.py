@@ -0,0 +1,104 @@
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+
+from src.inference.queue import AmqpPublisher, _connect
+
+BENCH_QUEUE = "bench_publish"
+
+
+def publish_once(body: str) -> None:
+    # как publish_predict_task работал раньше: соединение на каждое сообщение
+    conn = _connect()
+    try:
+        channel = conn.channel()
+        channel.queue_declare(queue=BENCH_QUEUE, durable=True)
+        channel.basic_publish(
+            exchange="",
+            routing_key=BENCH_QUEUE,
+            body=body,
+            properties=pika.BasicProperties(delivery_mode=2),
+        )
+    finally:
+        conn.close()
+
+
+def publish_pooled(publisher: AmqpPublisher, body: str) -> None:
+    publisher.publish(
+        BENCH_QUEUE, body, pika.BasicProperties(delivery_mode=2)
+    ).result(timeout=30)
+
+
+def timed(fn, n: int, threads: int) -> tuple[list[float], float]:
+    def one(i: int) -> float:
+        t0 = time.perf_counter()
+        fn(json.dumps({"request_id": str(i), "dt": "2026-01-01T10:00:00"}))
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if threads == 1:
+        latencies = [one(i) for i in range(n)]
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            latencies = list(pool.map(one, range(n)))
+    return latencies, time.perf_counter() - t0
+
+
+def report(name: str, latencies: list[float], total: float) -> None:
+    q = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:28s} p50 {q[49] * 1e3:7.2f} ms  p95 {q[94] * 1e3:7.2f} ms  "
+        f"{len(latencies) / total:8.0f} msg/s"
+    )
+
+
+def purge() -> None:
+    conn = _connect()
+    try:
+        conn.channel().queue_delete(queue=BENCH_QUEUE)
+    finally:
+        conn.close()
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description="Бенчмарк публикации: соединение на сообщение vs AmqpPublisher."
+    )
+    p.add_argument("-n", type=int, default=500, help="сообщений на режим")
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--channels", type=int, default=2)
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    publisher = AmqpPublisher(channels=args.channels, queues=(BENCH_QUEUE,))
+    publish_pooled(publisher, "{}")  # прогрев: соединение, каналы, declare
+    try:
+        report("connect-per-message", *timed(publish_once, args.n, 1))
+        report(f"connect-per-message ×{args.threads}", *timed(publish_once, args.n, args.threads))
+        pooled = lambda body: publish_pooled(publisher, body)  # noqa: E731
+        report("pooled", *timed(pooled, args.n, 1))
+        report(f"pooled ×{args.threads}", *timed(pooled, args.n, args.threads))
+
+        # без ожидания каждого ack: подтверждения приходят пачками
+        t0 = time.perf_counter()
+        futures = [
+            publisher.publish(BENCH_QUEUE, "{}", pika.BasicProperties(delivery_mode=2))
+            for _ in range(args.n)
+        ]
+        for f in futures:
+            f.result(timeout=30)
+        total = time.perf_counter() - t0
+        print(f"{'pooled pipelined':28s} {'':34s}{args.n / total:8.0f} msg/s")
+    finally:
+        publisher.close()
+        purge()
+
+
+if __name__ == "__main__":
+    main()
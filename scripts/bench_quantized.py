@@ -0,0 +1,102 @@
+import argparse
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from gensim.models import KeyedVectors
+from torch.utils.data import DataLoader
+
+from src.inference.worker import DROPOUT, HIDDEN_SIZE, MAX_NEWS_IN_WINDOW, NUM_LAYERS
+from src.ml.dataset import EMBED_DIM, NUMERIC_DIM, NewsLSTMDataset, collate
+from src.ml.eval import evaluate, format_metrics
+from src.ml.lstm import NewsLSTM, quantize_dynamic_int8
+from src.ml.train_lstm import predict
+
+DEFAULT_TEST = Path("data/processed/test.parquet")
+DEFAULT_W2V = Path("models/word2vec.kv")
+DEFAULT_LSTM = Path("models/lstm_best.pt")
+DEFAULT_SCALER = Path("models/lstm_scaler.pkl")
+
+
+def load_fp32(lstm_path: Path) -> NewsLSTM:
+    model = NewsLSTM(
+        embed_dim=EMBED_DIM,
+        hidden_size=HIDDEN_SIZE,
+        num_layers=NUM_LAYERS,
+        num_numeric=NUMERIC_DIM,
+        dropout=DROPOUT,
+    )
+    model.load_state_dict(torch.load(lstm_path, map_location="cpu"))
+    return model.eval()
+
+
+def latency(model: NewsLSTM, batch: int, seq_len: int, repeat: int) -> float:
+    text = torch.randn(batch, seq_len, EMBED_DIM) * 0.1
+    lengths = torch.full((batch,), seq_len, dtype=torch.long)
+    numeric = torch.randn(batch, NUMERIC_DIM)
+    timings = []
+    with torch.no_grad():
+        model(text, lengths, numeric)  # прогрев
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            model(text, lengths, numeric)
+            timings.append(time.perf_counter() - t0)
+    return float(np.median(timings))
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="NewsLSTM fp32 vs динамический int8 (CPU).")
+    p.add_argument("--test", type=Path, default=DEFAULT_TEST)
+    p.add_argument("--w2v", type=Path, default=DEFAULT_W2V)
+    p.add_argument("--lstm", type=Path, default=DEFAULT_LSTM)
+    p.add_argument("--scaler", type=Path, default=DEFAULT_SCALER)
+    p.add_argument("--seq-len", type=int, default=MAX_NEWS_IN_WINDOW)
+    p.add_argument("--repeat", type=int, default=30)
+    p.add_argument("--threads", type=int, default=1)
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    torch.set_num_threads(args.threads)
+    fp32 = load_fp32(args.lstm)
+    int8 = quantize_dynamic_int8(load_fp32(args.lstm))
+    print(f"CPU, threads={args.threads}, seq_len={args.seq_len}\n")
+
+    print("=== Латентность (медиана) и пропускная способность ===")
+    for batch in (1, 8, 64):
+        t32 = latency(fp32, batch, args.seq_len, args.repeat)
+        t8 = latency(int8, batch, args.seq_len, args.repeat)
+        print(
+            f"batch={batch:3d}  fp32: {t32 * 1e3:7.2f} ms ({batch / t32:8.0f}/s)  "
+            f"int8: {t8 * 1e3:7.2f} ms ({batch / t8:8.0f}/s)  ×{t32 / t8:4.2f}"
+        )
+
+    if not (args.test.exists() and args.w2v.exists() and args.scaler.exists()):
+        print(f"\nТочность пропущена: нет {args.test}, {args.w2v} или {args.scaler}")
+        return
+    with args.scaler.open("rb") as f:
+        fit_state = pickle.load(f)
+    kv = KeyedVectors.load(str(args.w2v))
+    loader = DataLoader(
+        NewsLSTMDataset(args.test, kv, fit_state=fit_state),
+        batch_size=64, shuffle=False, collate_fn=collate,
+    )
+    cpu = torch.device("cpu")
+    pred32, y_true = predict(fp32, loader, cpu)
+    pred8, _ = predict(int8, loader, cpu)
+    m32, m8 = evaluate(y_true, pred32), evaluate(y_true, pred8)
+    print(f"\n=== Точность на {args.test} ({len(y_true)} точек) ===")
+    print(format_metrics("fp32", m32))
+    print(format_metrics("int8", m8))
+    print(
+        f"Δmse={m8['mse'] - m32['mse']:+.3e} ({m8['mse'] / m32['mse'] - 1:+.2%})  "
+        f"Δdir_acc={(m8['dir_acc'] - m32['dir_acc']) * 100:+.2f} п.п.  "
+        f"max|Δy_pred|={np.abs(pred8 - pred32).max() * 100:.5f}%"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,15 @@ from __future__ import annotations
 
 import asyncio
 import time
-from contextlib import asynccontextmanager
+import uuid
+from collections.abc import Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager, suppress
 from datetime import datetime
 from typing import Any
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from src.api.schemas import (
     CompanyContributionOut,
@@ -16,100 +20,316 @@ from src.api.schemas import (
     NewsContributionOut,
     PredictionOut,
 )
+from src.common import tracing
+from src.common.metrics import REQUEST_SECONDS
+from src.common.time_utils import now_msk
+from src.common.tracing import stage
 from src.config import settings
 from src.inference.cache import PredictionCache
-from src.inference.explain import explain_at
-from src.inference.predict_worker import RESULT_PREFIX
-from src.inference.queue import publish_predict_task
-from src.inference.worker import _latest_valid_dt, _latest_valid_dts, load_artifacts
+from src.inference.candles import CandleBuffer
+from src.inference.keys import (
+    cache_key,
+    cache_keys,
+    explain_cache_key,
+    format_cache_key,
+    window_fingerprints,
+)
+from src.inference.queue import (
+    ReplyListener,
+    close_publisher,
+    publish_explain_task,
+    publish_predict_batch_task,
+    publish_predict_task,
+)
 from src.storage.db import (
     init_schema,
-    prediction_by_dt,
-    save_prediction,
+    predictions_by_dts,
     session_scope,
 )
 
+# только для ожидания dt, который считает другая реплика API
 POLL_INTERVAL_SEC = 0.1
+# как часто перечитывать из Redis версию модели, опубликованную predict-worker'ом
+MODEL_VERSION_REFRESH_SEC = 5.0
 
 state: dict[str, Any] = {}
 
+# свечи нужны API только для «последнего валидного dt»; модель — в predict-worker
+_candles = CandleBuffer()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_schema()
-    state["artifacts"] = load_artifacts()
     state["cache"] = PredictionCache()
+    # модель живёт только в predict-worker; её версию для ключей кэша он сам кладёт
+    # в Redis и в ответы — API её не вычисляет
+    state["model_version"] = None
+    state["model_version_at"] = float("-inf")
+    state["inflight"] = {}
+    state["replies"] = {}
+    state["loop"] = asyncio.get_running_loop()
+    listener = ReplyListener(_on_reply)
+    await asyncio.to_thread(listener.start)
+    state["listener"] = listener
     yield
+    await asyncio.to_thread(listener.stop)
+    await asyncio.to_thread(close_publisher)
+    state["cache"].close()
     state.clear()
 
 
 app = FastAPI(title="imoex-forecaster", version="0.1.0", lifespan=lifespan)
 
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Трейс на HTTP-запрос: спаны API, задачи в очереди и воркера (из ответа).
+    # X-Trace-Id — всегда; Server-Timing — при SERVER_TIMING=1 или заголовке X-Trace.
+    trace = tracing.Trace(service="api", name=request.url.path)
+    with tracing.activate(trace):
+        response = await call_next(request)
+    response.headers["X-Trace-Id"] = trace.trace_id
+    if trace.spans and (settings.server_timing or "x-trace" in request.headers):
+        response.headers["Server-Timing"] = trace.server_timing()
+    if trace.spans and settings.trace_dir:
+        await asyncio.to_thread(tracing.write, trace)
+    return response
+
+
+def _latest_valid_dts(k: int) -> list[datetime]:
+    return _candles.latest_valid_dts(k, until=now_msk())
+
+
 def _resolve_dt(dt: str | None) -> datetime:
     if dt is None:
-        return _latest_valid_dt()
+        return _latest_valid_dts(1)[0]
     try:
         return datetime.fromisoformat(dt)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=f"Невалидный dt: {exc}") from exc
 
 
-def _db_payload(result: dict[str, Any]) -> dict[str, Any]:
-    return {
-        "dt": result["dt"],
-        "y_pred": result["y_pred"],
-        "n_news": result["n_news"],
-        "ret_1": result["ret_1"],
-        "ret_60": result["ret_60"],
-        "ret_120": result["ret_120"],
-        "ner_org_weight_sum_mean": result["ner_org_weight_sum_mean"],
-        "ner_has_top_company_any": result["ner_has_top_company_any"],
-    }
-
-
 @app.get("/health")
 def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
-async def _compute_via_worker(dt_iso: str) -> dict[str, Any]:
-    cache: PredictionCache = state["cache"]
-    request_id = await asyncio.to_thread(publish_predict_task, dt_iso)
-    timeout = settings.predict_task_timeout_sec
-    deadline = time.monotonic() + timeout
-    while time.monotonic() < deadline:
-        await asyncio.sleep(POLL_INTERVAL_SEC)
-        result = cache.get_raw(f"{RESULT_PREFIX}{request_id}")
-        if result is None:
-            continue
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
-        with session_scope() as session:
-            save_prediction(session, _db_payload(result))
-        return result
-    raise HTTPException(
-        status_code=504,
-        detail=f"predict-worker не ответил за {timeout}с (req={request_id})",
+@app.get("/metrics")
+def metrics_endpoint() -> Response:
+    # Prometheus: стадии пути запроса, кэш по уровням; стадии воркера — на его METRICS_PORT
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache/stats")
+def cache_stats() -> dict[str, Any]:
+    # попадания/промахи по уровням: in-process LRU и Redis
+    return state["cache"].stats()
+
+
+def _model_version() -> str | None:
+    # None, пока воркер ни разу не отвечал и не публиковал версию: ключи не совпадут
+    # ни с чем, запрос уйдёт воркеру, и версия придёт в ответе
+    now = time.monotonic()
+    if now - state["model_version_at"] >= MODEL_VERSION_REFRESH_SEC:
+        version = state["cache"].model_version()
+        if version is not None:
+            state["model_version"] = version
+        state["model_version_at"] = now
+    return state["model_version"]
+
+
+def _on_reply(request_id: str, payload: dict[str, Any]) -> None:
+    # вызывается из потока ReplyListener; после остановки (state очищен) ответ некому отдать
+    loop = state.get("loop")
+    if loop is None:
+        return
+    with suppress(RuntimeError):  # loop уже закрыт
+        loop.call_soon_threadsafe(_resolve_reply, request_id, payload)
+
+
+def _resolve_reply(request_id: str, payload: dict[str, Any]) -> None:
+    future = state.get("replies", {}).pop(request_id, None)
+    if future is not None and not future.done():
+        future.set_result(payload)
+
+
+async def _request_worker(
+    publish: Callable[[Any, str, str], str], task: Any, timeout: int,
+) -> dict[str, Any]:
+    reply_to = state["listener"].queue_name
+    if reply_to is None:
+        raise HTTPException(status_code=503, detail="Нет соединения с RabbitMQ")
+    request_id = uuid.uuid4().hex
+    future = state["loop"].create_future()
+    state["replies"][request_id] = future
+    try:
+        with stage("publish"):
+            await asyncio.to_thread(publish, task, reply_to, request_id)
+        with stage("worker_wait"):
+            result = await asyncio.wait_for(future, timeout)
+    except TimeoutError as exc:
+        raise HTTPException(
+            status_code=504,
+            detail=f"predict-worker не ответил за {timeout}с (req={request_id})",
+        ) from exc
+    finally:
+        state["replies"].pop(request_id, None)
+    worker_trace = result.pop("trace", None)
+    if worker_trace:
+        tracing.extend(worker_trace["spans"])
+    if result.get("model_version"):
+        state["model_version"] = result["model_version"]
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+
+async def _publish_and_wait(dt_iso: str) -> dict[str, Any]:
+    # в predictions прогноз пишет сам predict-worker (write-behind), не путь запроса
+    return await _request_worker(
+        publish_predict_task, dt_iso, settings.predict_task_timeout_sec
     )
 
 
-@app.get("/predict", response_model=PredictionOut)
-async def predict(dt: str | None = Query(default=None, description="ISO-таймстемп закрытия свечи, МСК")):
-    t = _resolve_dt(dt)
+async def _wait_cached(key: str, timeout: float) -> dict[str, Any] | None:
+    # ждём результат другой реплики, пока она держит claim: если он снят без записи
+    # в кэш (ошибка, таймаут воркера), дальше ждать нечего
     cache: PredictionCache = state["cache"]
-    cache_key = t.isoformat()
+    with stage("redis_poll"):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL_SEC)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            if not cache.claimed(key):
+                # результат мог лечь между GET и проверкой claim
+                return cache.get(key)
+    return None
+
+
+async def _dispatch(dt_iso: str, key: str) -> dict[str, Any]:
+    cache: PredictionCache = state["cache"]
+    ttl = settings.predict_task_timeout_sec
+    token = cache.claim(key, ttl)
+    if token is None:
+        # этот ключ уже считает другая реплика API — ждём её результат в кэше,
+        # а если claim снят или истёк без результата, публикуем задачу сами
+        cached = await _wait_cached(key, ttl)
+        if cached is not None:
+            return cached
+        token = cache.claim(key, ttl)
+    try:
+        return await _publish_and_wait(dt_iso)
+    finally:
+        if token is not None:
+            cache.release(key, token)
+
+
+def _forget_inflight(key: str):
+    def callback(task: asyncio.Task) -> None:
+        state["inflight"].pop(key, None)
+        if not task.cancelled():
+            task.exception()  # помечаем как прочитанное, даже если ждущих не осталось
+
+    return callback
+
+
+async def _run_flight(key: str, start: Callable[[], Any]) -> tuple[Any, list[dict[str, Any]]]:
+    # у задачи свой трейс: create_task копирует контекст запроса, который её запустил,
+    # а ждать её могут несколько запросов или ни одного (фоновый пересчёт stale, когда
+    # трейс запроса уже записан). Спаны возвращаем вместе с результатом (или ошибкой).
+    # trace_id — запроса, который её запустил: он уходит в заголовок задачи, и трейс
+    # воркера в sink'е связан с X-Trace-Id, который получил клиент
+    trace = tracing.Trace(service="api", name=key)
+    trace.trace_id = tracing.current_trace_id() or trace.trace_id
+    with tracing.activate(trace):
+        try:
+            return await start(), trace.spans
+        except HTTPException as exc:
+            return exc, trace.spans
+
+
+def _start_flight(key: str, start: Callable[[], Any]) -> asyncio.Task:
+    # одна задача на ключ, пока она не завершилась
+    inflight: dict[str, asyncio.Task] = state["inflight"]
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_run_flight(key, start))
+        inflight[key] = task
+        task.add_done_callback(_forget_inflight(key))
+    return task
+
+
+async def _single_flight(key: str, start: Callable[[], Any]) -> dict[str, Any]:
+    # конкурентные промахи по одному ключу ждут одну и ту же задачу;
+    # её спаны (publish, worker_wait, воркер) получает трейс каждого ждущего
+    result, spans = await asyncio.shield(_start_flight(key, start))
+    tracing.extend(spans)
+    if isinstance(result, HTTPException):
+        raise result
+    return result
+
+
+async def _compute_via_worker(dt_iso: str, key: str) -> dict[str, Any]:
+    return await _single_flight(key, lambda: _dispatch(dt_iso, key))
+
+
+async def _explain_via_worker(dt_iso: str) -> dict[str, Any]:
+    return await _single_flight(
+        f"explain:{dt_iso}",
+        lambda: _request_worker(publish_explain_task, dt_iso, settings.explain_task_timeout_sec),
+    )
 
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return PredictionOut(**cached)
 
-    result = await _compute_via_worker(cache_key)
-    return PredictionOut(**result)
+@contextmanager
+def _observe_request(endpoint: str) -> Iterator[dict[str, str]]:
+    # латентность эндпоинта — и для ошибок (400, 503, 504): source выставляет эндпоинт,
+    # пока он не известен — "none"
+    labels = {"source": "none", "status": "200"}
+    t0 = time.perf_counter()
+    try:
+        yield labels
+    except HTTPException as exc:
+        labels["status"] = str(exc.status_code)
+        raise
+    except Exception:
+        labels["status"] = "500"
+        raise
+    finally:
+        REQUEST_SECONDS.labels(endpoint=endpoint, **labels).observe(time.perf_counter() - t0)
+
+
+@app.get("/predict", response_model=PredictionOut)
+async def predict(dt: str | None = Query(default=None, description="ISO-таймстемп закрытия свечи, МСК")):
+    with _observe_request("predict") as labels:
+        t = _resolve_dt(dt)
+        cache: PredictionCache = state["cache"]
+        version = _model_version()
+        # ключ — dt + версия модели + отпечаток окна новостей (один индексный запрос)
+        key = await asyncio.to_thread(cache_key, t, version)
+
+        cached = cache.get(key)
+        if cached is not None:
+            labels["source"] = "cache"
+            return PredictionOut(**cached)
+
+        # Окно изменилось (пришла новость) или ключа нет. Если по dt есть ответ не старше
+        # PREDICT_STALE_TTL_SEC — отдаём его сразу со stale=true, пересчёт идёт в фоне.
+        stale = cache.get_stale_many([t.isoformat()], version)
+        if stale:
+            _start_flight(key, lambda: _dispatch(t.isoformat(), key))
+            labels["source"] = "stale"
+            return PredictionOut(**stale[t.isoformat()], stale=True)
+
+        labels["source"] = "worker"
+        result = await _compute_via_worker(t.isoformat(), key)
+        return PredictionOut(**result)
 
 
 def _history_item_from_payload(
-    dt: datetime, y_pred: float, n_news: int, has_top: bool,
+    dt: datetime, y_pred: float, n_news: int, has_top: bool, stale: bool = False,
 ) -> HistoryItem:
     return HistoryItem(
         dt=dt,
@@ -117,86 +337,154 @@ def _history_item_from_payload(
         y_pred_pct=y_pred * 100,
         n_news=n_news,
         ner_has_top_company_any=has_top,
+        stale=stale,
     )
 
 
-async def _resolve_history_item(dt: datetime) -> HistoryItem:
-    iso = dt.isoformat()
-    cache: PredictionCache = state["cache"]
+def _fresh_rows(
+    rows: dict[datetime, dict[str, Any]], keys: dict[datetime, str],
+) -> dict[datetime, dict[str, Any]]:
+    # строка из predictions годится, если её версия модели и отпечаток окна, на котором
+    # она посчитана, совпадают с текущим ключом dt (при закрытом рынке окно тянется до now)
+    rows = {dt: row for dt, row in rows.items() if row["window_start"] is not None}
+    stored = window_fingerprints(
+        [(row["window_start"], row["window_end"]) for row in rows.values()]
+    )
+    return {
+        dt: row for (dt, row), fingerprint in zip(rows.items(), stored, strict=True)
+        if keys[dt] == format_cache_key(dt, row["model_version"], fingerprint)
+    }
+
 
-    cached = cache.get(iso)
-    if cached is not None:
-        return _history_item_from_payload(
-            dt, float(cached["y_pred"]), int(cached["n_news"]),
-            bool(cached["ner_has_top_company_any"]),
+def _lookup_history_items(
+    dts: list[datetime], version: str | None,
+) -> dict[datetime, HistoryItem]:
+    # отпечатки всех окон — один запрос, затем один MGET в Redis,
+    # остаток — одним запросом в predictions
+    keys = dict(zip(dts, cache_keys(dts, version), strict=True))
+    cached = state["cache"].get_many(list(keys.values()))
+    payloads = {dt: cached[keys[dt]] for dt in dts if keys[dt] in cached}
+    rest = [dt for dt in dts if dt not in payloads]
+    if rest:
+        with session_scope() as session:
+            rows = predictions_by_dts(session, rest)
+        payloads.update(_fresh_rows(rows, keys))
+    return {
+        dt: _history_item_from_payload(
+            dt, float(payload["y_pred"]), int(payload["n_news"]),
+            bool(payload["ner_has_top_company_any"]),
         )
+        for dt, payload in payloads.items()
+    }
 
-    with session_scope() as session:
-        row = prediction_by_dt(session, dt)
-    if row is not None:
-        return _history_item_from_payload(
-            dt, float(row["y_pred"]), int(row["n_news"]),
-            bool(row["ner_has_top_company_any"]),
+
+def _lookup_stale_items(
+    dts: list[datetime], version: str | None,
+) -> dict[datetime, HistoryItem]:
+    # последние ответы по dt с другим отпечатком окна — одним MGET
+    cached = state["cache"].get_stale_many([dt.isoformat() for dt in dts], version)
+    return {
+        dt: _history_item_from_payload(
+            dt, float(payload["y_pred"]), int(payload["n_news"]),
+            bool(payload["ner_has_top_company_any"]), stale=True,
         )
+        for dt in dts
+        if (payload := cached.get(dt.isoformat())) is not None
+    }
+
 
-    result = await _compute_via_worker(iso)
-    return _history_item_from_payload(
-        dt, float(result["y_pred"]), int(result["n_news"]),
-        bool(result["ner_has_top_company_any"]),
+async def _compute_history_batch(dts: list[datetime]) -> dict[datetime, HistoryItem]:
+    # все промахи /history — одной batch-задачей: воркер читает свечи и новости один раз
+    result = await _request_worker(
+        publish_predict_batch_task,
+        [dt.isoformat() for dt in dts],
+        settings.predict_task_timeout_sec,
     )
+    payloads = result["items"]
+    for payload in payloads:
+        if "error" in payload:
+            raise HTTPException(status_code=400, detail=payload["error"])
+    return {
+        dt: _history_item_from_payload(
+            dt, float(payload["y_pred"]), int(payload["n_news"]),
+            bool(payload["ner_has_top_company_any"]),
+        )
+        for dt, payload in zip(dts, payloads, strict=True)
+    }
 
 
 @app.get("/history", response_model=HistoryOut)
 async def history(
     k: int = Query(default=5, ge=1, le=50, description="Сколько часов назад вернуть прогнозов"),
 ):
-    try:
-        dts = await asyncio.to_thread(_latest_valid_dts, k)
-    except SystemExit as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-    items = [await _resolve_history_item(dt) for dt in dts]
-    return HistoryOut(items=items)
+    with _observe_request("history") as labels:
+        try:
+            dts = await asyncio.to_thread(_latest_valid_dts, k)
+        except SystemExit as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        version = _model_version()
+        with stage("history_lookup"):
+            found = await asyncio.to_thread(_lookup_history_items, dts, version)
+        labels["source"] = "cache"
+        misses = [dt for dt in dts if dt not in found]
+        if misses:
+            stale = await asyncio.to_thread(_lookup_stale_items, misses, version)
+            if stale:
+                # stale отдаём сразу, их пересчёт — одна фоновая batch-задача
+                refresh = sorted(stale)
+                _start_flight(
+                    "history:" + ",".join(dt.isoformat() for dt in refresh),
+                    lambda: _compute_history_batch(refresh),
+                )
+                found.update(stale)
+                misses = [dt for dt in misses if dt not in stale]
+                labels["source"] = "stale"
+        if misses:
+            labels["source"] = "worker"
+            found.update(await _compute_history_batch(misses))
+        return HistoryOut(items=[found[dt] for dt in dts])
 
 
 @app.get("/explain", response_model=ExplainOut)
-def explain(
+async def explain(
     dt: str | None = Query(default=None),
     top_news: int = Query(default=5, ge=1, le=20),
     top_companies: int = Query(default=5, ge=1, le=20),
 ):
-    t = _resolve_dt(dt)
-    try:
-        result = explain_at(
-            state["artifacts"], t,
-            top_news=top_news, top_companies=top_companies,
+    with _observe_request("explain") as labels:
+        t = _resolve_dt(dt)
+        cache: PredictionCache = state["cache"]
+        key = await asyncio.to_thread(explain_cache_key, t, _model_version())
+        result = cache.get_raw(cache.explain_key(key), settings.explain_cache_ttl_sec)
+        labels["source"] = "cache"
+        if result is None:
+            labels["source"] = "worker"
+            result = await _explain_via_worker(t.isoformat())
+        return ExplainOut(
+            dt=result["dt"],
+            y_pred=result["y_pred"],
+            y_pred_pct=result["y_pred"] * 100,
+            y_no_news_pct=result["y_no_news"] * 100,
+            market_status=result["market_status"],
+            window_start=result["window_start"],
+            window_end=result["window_end"],
+            top_news=[
+                NewsContributionOut(
+                    title=n["title"],
+                    contribution=n["contribution"],
+                    contribution_pct=n["contribution"] * 100,
+                    tickers=n["tickers"],
+                )
+                for n in result["top_news"][:top_news]
+            ],
+            top_companies=[
+                CompanyContributionOut(
+                    ticker=c["ticker"],
+                    name=c["name"],
+                    n_news=c["n_news"],
+                    contribution=c["contribution"],
+                    contribution_pct=c["contribution"] * 100,
+                )
+                for c in result["top_companies"][:top_companies]
+            ],
         )
-    except SystemExit as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return ExplainOut(
-        dt=result.dt,
-        y_pred=result.y_pred,
-        y_pred_pct=result.y_pred * 100,
-        y_no_news_pct=result.y_no_news * 100,
-        market_status=result.market_status,
-        window_start=result.window_start,
-        window_end=result.window_end,
-        top_news=[
-            NewsContributionOut(
-                title=n.title,
-                contribution=n.contribution,
-                contribution_pct=n.contribution * 100,
-                tickers=n.tickers,
-            )
-            for n in result.top_news
-        ],
-        top_companies=[
-            CompanyContributionOut(
-                ticker=c.ticker,
-                name=c.name,
-                n_news=c.n_news,
-                contribution=c.contribution,
-                contribution_pct=c.contribution * 100,
-            )
-            for c in result.top_companies
-        ],
-    )
@@ -19,6 +19,7 @@ class PredictionOut(BaseModel):
     market_status: str
     window_start: datetime
     window_end: datetime
+    stale: bool = False
 
 
 class HistoryItem(BaseModel):
@@ -27,6 +28,7 @@ class HistoryItem(BaseModel):
     y_pred_pct: float
     n_news: int
     ner_has_top_company_any: bool
+    stale: bool = False
 
 
 class HistoryOut(BaseModel):
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+SMAPS_ROLLUP = Path("/proc/self/smaps_rollup")
+STATUS = Path("/proc/self/status")
+
+
+def memory_usage() -> dict[str, int] | None:
+    # kB из /proc (Linux): rss — всё резидентное, shared — страницы, которые процесс
+    # делит с другими (в т.ч. page cache mmap-файлов), private — только его собственные.
+    if SMAPS_ROLLUP.exists():
+        fields = _read_kb(SMAPS_ROLLUP)
+        return {
+            "rss": fields.get("Rss", 0),
+            "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        }
+    if STATUS.exists():
+        fields = _read_kb(STATUS)
+        return {
+            "rss": fields.get("VmRSS", 0),
+            "shared": fields.get("RssFile", 0) + fields.get("RssShmem", 0),
+            "private": fields.get("RssAnon", 0),
+        }
+    return None
+
+
+def format_memory_usage() -> str:
+    usage = memory_usage()
+    if usage is None:
+        return "n/a"
+    return ", ".join(f"{k}={v / 1024:.0f}MB" for k, v in usage.items())
+
+
+def _read_kb(path: Path) -> dict[str, int]:
+    fields: dict[str, int] = {}
+    for line in path.read_text().splitlines():
+        name, _, rest = line.partition(":")
+        parts = rest.split()
+        if len(parts) == 2 and parts[1] == "kB":
+            fields[name] = int(parts[0])
+    return fields
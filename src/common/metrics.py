@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+# Метрики пути инференса (общие для API и predict-worker) на prometheus_client.
+# API отдаёт их на /metrics (generate_latest), predict-worker — через start_http_server
+# на METRICS_PORT. Реестр по умолчанию, метрики процесс-локальные.
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def sample_value(name: str, **labels: str) -> float:
+    # текущее значение серии (для /cache/stats); серии, которых ещё не было, — 0
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+STAGE_SECONDS = Histogram(
+    "imoex_stage_seconds",
+    "Длительность стадий пути инференса",
+    ("stage",),
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "imoex_request_seconds",
+    "Латентность эндпоинтов API по источнику ответа и HTTP-статусу",
+    ("endpoint", "source", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "imoex_cache_requests_total",
+    "Обращения к кэшу прогнозов по уровням (local, redis) и результату (hit, miss)",
+    ("tier", "result"),
+)
+CACHE_ERRORS = Counter(
+    "imoex_cache_errors_total",
+    "Ошибки Redis в PredictionCache",
+)
+QUEUE_DEPTH = Gauge(
+    "imoex_queue_depth",
+    "Сообщений в очереди задач (последний замер воркера)",
+    ("queue",),
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "imoex_queue_wait_seconds",
+    "Время задачи в очереди: от публикации до получения воркером",
+    ("queue",),
+    buckets=LATENCY_BUCKETS,
+)
+WORKER_BATCH_SIZE = Histogram(
+    "imoex_worker_batch_size",
+    "Задач в пачке, отданной handler'у очереди",
+    ("queue",),
+    buckets=SIZE_BUCKETS,
+)
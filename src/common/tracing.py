@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from src.common.metrics import STAGE_SECONDS
+from src.config import settings
+
+# Трассировка одного запроса через API → RabbitMQ → predict-worker → Redis.
+# Trace — id и список спанов (имя, сервис, начало по wall clock, длительность).
+# Активные трейсы лежат в contextvar: stage() пишет спан во все активные (воркер
+# считает пачку задач разных запросов одним проходом) и всегда — в гистограмму
+# imoex_stage_seconds. Без активного трейса stage() — только метрика.
+
+logger = logging.getLogger("common.tracing")
+
+_active: ContextVar[tuple[Trace, ...]] = ContextVar("imoex_traces", default=())
+_sink_lock = threading.Lock()
+
+
+@dataclass
+class Trace:
+    service: str
+    name: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    start: float = field(default_factory=time.time)
+    spans: list[dict[str, Any]] = field(default_factory=list)
+
+    def add(self, name: str, start: float, dur_sec: float, service: str | None = None) -> None:
+        self.spans.append({
+            "name": name,
+            "service": service or self.service,
+            "start": round(start, 6),
+            "dur_ms": round(dur_sec * 1e3, 3),
+        })
+
+    def extend(self, spans: list[dict[str, Any]]) -> None:
+        self.spans.extend(spans)
+
+    def duration_ms(self) -> float:
+        return (time.time() - self.start) * 1e3
+
+    def server_timing(self) -> str:
+        # Server-Timing: <service>.<stage>;dur=<ms>, … в порядке начала
+        spans = sorted(self.spans, key=lambda s: s["start"])
+        return ", ".join(f"{s['service']}.{s['name']};dur={s['dur_ms']}" for s in spans)
+
+
+def current_trace_id() -> str | None:
+    traces = _active.get()
+    return traces[0].trace_id if traces else None
+
+
+@contextmanager
+def activate(*traces: Trace) -> Iterator[None]:
+    token = _active.set(traces)
+    try:
+        yield
+    finally:
+        _active.reset(token)
+
+
+def extend(spans: list[dict[str, Any]]) -> None:
+    # спаны другого процесса (из ответа воркера) — в текущий трейс
+    for trace in _active.get():
+        trace.extend(spans)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dur = time.perf_counter() - t0
+        STAGE_SECONDS.labels(stage=name).observe(dur)
+        for trace in _active.get():
+            trace.add(name, start, dur)
+
+
+def write(trace: Trace) -> None:
+    # локальный JSONL-sink: TRACE_DIR/<service>.jsonl; пишем трейсы не короче TRACE_MIN_MS
+    if not settings.trace_dir:
+        return
+    total_ms = trace.duration_ms()
+    if total_ms < settings.trace_min_ms:
+        return
+    record = {**asdict(trace), "dur_ms": round(total_ms, 3)}
+    path = Path(settings.trace_dir) / f"{trace.service}.jsonl"
+    try:
+        with _sink_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    except OSError as exc:
+        logger.warning("trace sink %s: %s", path, exc)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from typing import Any
+
+import pandas as pd
+
+from src.config import settings
+from src.inference.candles import RET_COLS, enrich, fetch_candles
+from src.inference.keys import model_version
+from src.inference.news import feature_version
+from src.inference.predict_worker import _to_payload
+from src.inference.worker import (
+    ENGINES,
+    InferenceArtifacts,
+    load_artifacts,
+    predict_batch,
+    prepare_inputs,
+)
+from src.storage.db import init_schema, prediction_dts, session_scope, upsert_predictions
+
+DEFAULT_CHUNK = 500
+DEFAULT_BATCH = 256
+
+# артефакты процесса-воркера пула, грузятся один раз в initializer
+_artifacts: InferenceArtifacts | None = None
+
+
+def parse_till(value: str) -> datetime:
+    # дата без времени — весь день включительно, а не его полночь
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        return datetime.fromisoformat(value)
+    return datetime.combine(day, datetime.max.time())
+
+
+def hourly_rows(start: datetime, till: datetime) -> dict[datetime, pd.Series]:
+    # свечи читаются один раз; нужны строки с валидным lookback в [start, till]
+    candles = enrich(fetch_candles(until=till))
+    valid = candles[RET_COLS].notna().all(axis=1) & (candles["dt"] >= pd.Timestamp(start))
+    return {row["dt"].to_pydatetime(): row for _, row in candles.loc[valid].iterrows()}
+
+
+def _init_worker(engine: str | None, device: str | None, threads: int) -> None:
+    global _artifacts
+    if (engine or settings.inference_engine) != "numpy":
+        import torch
+
+        torch.set_num_threads(threads)
+    _artifacts = load_artifacts(device=device, engine=engine)
+
+
+def _run_chunk(
+    dts: list[datetime], rows: dict[datetime, pd.Series], batch_size: int,
+) -> tuple[list[dict[str, Any]], dict[datetime, str]]:
+    assert _artifacts is not None
+    # окно «как в момент dt»: [dt − 4ч, dt), независимо от того, открыт ли рынок сейчас
+    inputs, errors = prepare_inputs(_artifacts, dts, rows=rows, historical=True)
+    payloads = []
+    for i in range(0, len(inputs), batch_size):
+        for result in predict_batch(_artifacts, inputs[i:i + batch_size]):
+            payloads.append(_to_payload(result, _artifacts.model_version))
+    return payloads, errors
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Бэкфилл таблицы predictions за период")
+    p.add_argument("--from", dest="start", required=True, help="ISO, МСК")
+    p.add_argument(
+        "--till", required=True, help="ISO, МСК (включительно; дата без времени — до конца дня)",
+    )
+    p.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() // 2))
+    p.add_argument("--threads-per-worker", type=int, default=1)
+    p.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK, help="dt на задачу пула")
+    p.add_argument("--batch-size", type=int, default=DEFAULT_BATCH, help="окон на forward")
+    p.add_argument("--engine", choices=ENGINES, default=None)
+    p.add_argument("--device", default="cpu")
+    p.add_argument("--force", action="store_true", help="пересчитать и уже посчитанные dt")
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    start, till = datetime.fromisoformat(args.start), parse_till(args.till)
+    init_schema()
+
+    rows = hourly_rows(start, till)
+    version = model_version(
+        feature_version(settings.paths.w2v, settings.paths.tickers), engine=args.engine,
+    )
+    done: set[datetime] = set()
+    if not args.force:
+        with session_scope() as s:
+            done = prediction_dts(s, start, till, version)
+    todo = [dt for dt in sorted(rows) if dt not in done]
+    print(
+        f"Период {start} … {till}: свечей {len(rows)}, уже посчитано ({version}) "
+        f"{len(rows) - len(todo)}, к расчёту {len(todo)}"
+    )
+    if not todo:
+        return
+
+    chunks = [todo[i:i + args.chunk_size] for i in range(0, len(todo), args.chunk_size)]
+    t0 = time.perf_counter()
+    n_done = n_failed = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.engine, args.device, args.threads_per_worker),
+    ) as pool:
+        futures = [
+            pool.submit(_run_chunk, chunk, {dt: rows[dt] for dt in chunk}, args.batch_size)
+            for chunk in chunks
+        ]
+        for future in as_completed(futures):
+            payloads, errors = future.result()
+            with session_scope() as s:
+                upsert_predictions(s, payloads)
+            n_done += len(payloads)
+            n_failed += len(errors)
+            for dt, error in list(errors.items())[:3]:
+                print(f"  пропуск {dt}: {error}")
+            elapsed = time.perf_counter() - t0
+            print(
+                f"[{n_done + n_failed}/{len(todo)}] записано {n_done}, ошибок {n_failed}, "
+                f"{elapsed:.0f}s, {n_done / elapsed:.1f} dt/s",
+                flush=True,
+            )
+    print(f"Готово: {n_done} прогнозов за {time.perf_counter() - t0:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
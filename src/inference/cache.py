@@ -2,78 +2,331 @@ from __future__ import annotations
 
 import json
 import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from typing import Any
 
 import redis
 
+from src.common.metrics import CACHE_ERRORS, CACHE_REQUESTS, sample_value
 from src.config import settings
 
 KEY_PREFIX = "predict:"
+CLAIM_PREFIX = "predict:claim:"
+EXPLAIN_PREFIX = "explain:"
+# версия модели текущего predict-worker'а (без TTL): по ней API строит ключи кэша
+MODEL_VERSION_KEY = "predict:model_version"
+REDIS_CONNECT_TIMEOUT_SEC = 2
+# снять claim, только если он ещё наш: истёкший и перехваченный другой репликой не трогаем
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
 
 logger = logging.getLogger("inference.cache")
 
 
+class LocalLRU:
+    # In-process LRU перед Redis: разобранные payload'ы (без сети и json.loads),
+    # ограничен числом записей и суммарным размером их JSON; срок жизни — тот же TTL,
+    # что у ключа в Redis. Значения общие для всех читателей — их не мутируют.
+    def __init__(self, maxsize: int, maxbytes: int) -> None:
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._items: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, size, expires_at = item
+            if time.monotonic() >= expires_at:
+                del self._items[key]
+                self._nbytes -= size
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, size: int, ttl_sec: float) -> None:
+        if self._maxsize <= 0 or size > self._maxbytes or ttl_sec <= 0:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[1]
+            self._items[key] = (value, size, time.monotonic() + ttl_sec)
+            self._nbytes += size
+            while len(self._items) > self._maxsize or self._nbytes > self._maxbytes:
+                _, (_, evicted, _) = self._items.popitem(last=False)
+                self._nbytes -= evicted
+
+
 class PredictionCache:
-    def __init__(self, url: str | None = None, ttl_sec: int | None = None) -> None:
+    # Прогнозы лежат под predict:<cache_key>, где cache_key = dt + версия модели +
+    # отпечаток окна новостей (worker.cache_key): значение по ключу не устаревает,
+    # TTL только ограничивает память Redis.
+    # Два уровня: LocalLRU в процессе, за ним Redis. Если Redis недоступен (при старте
+    # или отвалился по ходу), работаем на локальном уровне, а фоновый поток
+    # переподключается раз в REDIS_RECONNECT_SEC.
+    def __init__(
+        self,
+        url: str | None = None,
+        ttl_sec: int | None = None,
+        local_size: int | None = None,
+        local_bytes: int | None = None,
+    ) -> None:
         self._url = url or settings.redis_url
         self._ttl = ttl_sec if ttl_sec is not None else settings.redis_ttl_sec
+        self._local = LocalLRU(
+            local_size if local_size is not None else settings.local_cache_size,
+            local_bytes if local_bytes is not None else settings.local_cache_bytes,
+        )
         self._client: redis.Redis | None = None
-        try:
-            client = redis.Redis.from_url(self._url, decode_responses=True)
-            client.ping()
-            self._client = client
-            logger.info("redis connected: %s (ttl=%ds)", self._url, ttl_sec)
-        except Exception as exc:
-            logger.warning("redis unavailable (%s): %s — кэш отключён", self._url, exc)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reconnect_thread: threading.Thread | None = None
+        if not self._connect():
+            self._start_reconnect()
 
     @property
     def available(self) -> bool:
         return self._client is not None
 
     @staticmethod
-    def key(dt_iso: str) -> str:
-        return f"{KEY_PREFIX}{dt_iso}"
+    def key(cache_key: str) -> str:
+        return f"{KEY_PREFIX}{cache_key}"
 
-    def get(self, dt_iso: str) -> dict[str, Any] | None:
-        if self._client is None:
-            return None
+    @staticmethod
+    def stale_key(dt_iso: str, version: str | None) -> str:
+        return f"stale:{dt_iso}:{version}"
+
+    @staticmethod
+    def explain_key(cache_key: str) -> str:
+        return f"{EXPLAIN_PREFIX}{cache_key}"
+
+    def stats(self) -> dict[str, Any]:
+        counts = {
+            f"{tier}_{name}": int(
+                sample_value("imoex_cache_requests_total", tier=tier, result=result)
+            )
+            for tier in ("local", "redis")
+            for name, result in (("hits", "hit"), ("misses", "miss"))
+        }
+        return {
+            "redis_available": self.available,
+            "local_entries": len(self._local),
+            "local_bytes": self._local.nbytes,
+            **counts,
+            "redis_errors": int(sample_value("imoex_cache_errors_total")),
+        }
+
+    def close(self) -> None:
+        self._stop.set()
+
+    # --- подключение ---
+
+    def _connect(self) -> bool:
         try:
-            raw = self._client.get(self.key(dt_iso))
-        except redis.RedisError as exc:
-            logger.warning("redis get failed: %s", exc)
-            return None
-        if raw is None:
-            return None
+            client = redis.Redis.from_url(
+                self._url,
+                decode_responses=True,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT_SEC,
+            )
+            client.ping()
+        except Exception as exc:
+            logger.warning("redis unavailable (%s): %s — пока только локальный кэш", self._url, exc)
+            return False
+        self._client = client
+        logger.info("redis connected: %s (ttl=%ds)", self._url, self._ttl)
+        return True
+
+    def _start_reconnect(self) -> None:
+        with self._lock:
+            if self._reconnect_thread is not None and self._reconnect_thread.is_alive():
+                return
+            self._reconnect_thread = threading.Thread(
+                target=self._reconnect_loop, name="redis-reconnect", daemon=True
+            )
+            self._reconnect_thread.start()
+
+    def _reconnect_loop(self) -> None:
+        while not self._stop.wait(settings.redis_reconnect_sec):
+            if self._connect():
+                return
+
+    def _failed(self, op: str, key: str, exc: redis.RedisError) -> None:
+        CACHE_ERRORS.inc()
+        logger.warning("redis %s failed (%s): %s", op, key, exc)
+        if isinstance(exc, redis.ConnectionError | redis.TimeoutError):
+            self._client = None
+            self._start_reconnect()
+
+    def _decode(self, key: str, raw: str, local_ttl: float) -> Any | None:
         try:
-            return json.loads(raw)
+            value = json.loads(raw)
         except json.JSONDecodeError:
-            logger.warning("redis: невалидный JSON в %s", dt_iso)
+            logger.warning("redis: невалидный JSON в %s", key)
             return None
+        # оставшийся TTL ключа в Redis неизвестен без лишнего запроса — берём TTL,
+        # с которым такие ключи пишутся: локальная копия не переживёт запись в Redis
+        self._local.put(key, value, len(raw), local_ttl)
+        return value
 
-    def set(self, dt_iso: str, payload: dict[str, Any]) -> None:
-        self.set_raw(self.key(dt_iso), payload)
+    def _lookup(self, keys: list[str], local_ttl: float) -> dict[str, Any]:
+        # сначала локальный уровень, остаток — одним GET/MGET; в ответе только найденные.
+        # local_ttl <= 0 — мимо локального уровня (ключи, значение которых перезаписывается)
+        found: dict[str, Any] = {}
+        rest = keys
+        if local_ttl > 0:
+            rest = []
+            for key in keys:
+                value = self._local.get(key)
+                if value is None:
+                    rest.append(key)
+                else:
+                    found[key] = value
+            CACHE_REQUESTS.labels(tier="local", result="hit").inc(len(found))
+            CACHE_REQUESTS.labels(tier="local", result="miss").inc(len(rest))
+        client = self._client
+        if client is None or not rest:
+            return found
+        try:
+            raws = client.mget(rest) if len(rest) > 1 else [client.get(rest[0])]
+        except redis.RedisError as exc:
+            self._failed("mget", f"{len(rest)} keys", exc)
+            return found
+        for key, raw in zip(rest, raws, strict=True):
+            value = self._decode(key, raw, local_ttl) if raw is not None else None
+            if value is None:
+                CACHE_REQUESTS.labels(tier="redis", result="miss").inc()
+            else:
+                CACHE_REQUESTS.labels(tier="redis", result="hit").inc()
+                found[key] = value
+        return found
 
-    def get_raw(self, key: str) -> dict[str, Any] | None:
-        if self._client is None:
-            return None
+    # --- чтение/запись ---
+
+    def get(self, cache_key: str) -> dict[str, Any] | None:
+        return self.get_raw(self.key(cache_key))
+
+    def get_many(self, cache_keys: list[str]) -> dict[str, dict[str, Any]]:
+        keys = {cache_key: self.key(cache_key) for cache_key in cache_keys}
+        found = self._lookup(list(keys.values()), self._ttl)
+        return {cache_key: found[key] for cache_key, key in keys.items() if key in found}
+
+    def set(self, cache_key: str, payload: dict[str, Any], ttl_sec: int | None = None) -> None:
+        self.set_raw(self.key(cache_key), payload, ttl_sec)
+
+    # stale-while-revalidate: последний ответ по dt независимо от отпечатка окна.
+    # Жёсткий TTL — абсолютный срок внутри записи. Ключ stale:<dt>:<версия> не
+    # content-addressed (пересчёт его перезаписывает), поэтому только в Redis.
+
+    def set_stale(
+        self, dt_iso: str, version: str | None, payload: dict[str, Any], ttl_sec: int,
+    ) -> None:
+        entry = {"until": time.time() + ttl_sec, "payload": payload}
+        self.set_raw(self.key(self.stale_key(dt_iso, version)), entry, ttl_sec, local=False)
+
+    def get_stale_many(self, dt_isos: list[str], version: str | None) -> dict[str, dict[str, Any]]:
+        keys = {dt_iso: self.key(self.stale_key(dt_iso, version)) for dt_iso in dt_isos}
+        entries = self._lookup(list(keys.values()), local_ttl=0)
+        now = time.time()
+        return {
+            dt_iso: entry["payload"]
+            for dt_iso, key in keys.items()
+            if (entry := entries.get(key)) is not None and entry["until"] > now
+        }
+
+    def get_raw(self, key: str, ttl_sec: int | None = None) -> dict[str, Any] | None:
+        # ttl_sec — TTL, с которым пишутся такие ключи (explain — свой, короче REDIS_TTL_SEC)
+        return self._lookup([key], ttl_sec if ttl_sec is not None else self._ttl).get(key)
+
+    def set_raw(
+        self,
+        key: str,
+        payload: dict[str, Any],
+        ttl_sec: int | None = None,
+        local: bool = True,
+    ) -> None:
+        ttl = ttl_sec if ttl_sec is not None else self._ttl
+        raw = json.dumps(payload, default=str)
+        if local:
+            # локально — в том виде, в каком его вернул бы Redis (datetime → str)
+            self._local.put(key, json.loads(raw), len(raw), ttl)
+        client = self._client
+        if client is None:
+            return
         try:
-            raw = self._client.get(key)
+            client.setex(key, ttl, raw)
         except redis.RedisError as exc:
-            logger.warning("redis get failed (%s): %s", key, exc)
-            return None
-        if raw is None:
+            self._failed("set", key, exc)
+
+    def publish_model_version(self, version: str) -> None:
+        client = self._client
+        if client is None:
+            return
+        try:
+            client.set(MODEL_VERSION_KEY, version)
+        except redis.RedisError as exc:
+            self._failed("set", MODEL_VERSION_KEY, exc)
+
+    def model_version(self) -> str | None:
+        # мимо локального уровня: версия меняется при рестарте воркера с новыми весами
+        client = self._client
+        if client is None:
             return None
         try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
-            logger.warning("redis: невалидный JSON в %s", key)
+            return client.get(MODEL_VERSION_KEY)
+        except redis.RedisError as exc:
+            self._failed("get", MODEL_VERSION_KEY, exc)
             return None
 
-    def set_raw(self, key: str, payload: dict[str, Any], ttl_sec: int | None = None) -> None:
-        if self._client is None:
+    def claim(self, name: str, ttl_sec: int) -> str | None:
+        # SET NX со случайным токеном: токен — мы первые (или Redis недоступен
+        # и координировать нечем), None — ключ уже считает другая реплика
+        token = uuid.uuid4().hex
+        client = self._client
+        if client is None:
+            return token
+        try:
+            claimed = client.set(f"{CLAIM_PREFIX}{name}", token, nx=True, ex=ttl_sec)
+        except redis.RedisError as exc:
+            self._failed("claim", name, exc)
+            return token
+        return token if claimed else None
+
+    def claimed(self, name: str) -> bool:
+        # держит ли claim ещё кто-то; без Redis claim'ов нет
+        client = self._client
+        if client is None:
+            return False
+        try:
+            return bool(client.exists(f"{CLAIM_PREFIX}{name}"))
+        except redis.RedisError as exc:
+            self._failed("exists", name, exc)
+            return False
+
+    def release(self, name: str, token: str) -> None:
+        # compare-and-delete: claim мог истечь, пока воркер считал, и достаться
+        # другой реплике — её claim не удаляем
+        client = self._client
+        if client is None:
             return
-        ttl = ttl_sec if ttl_sec is not None else self._ttl
         try:
-            self._client.setex(key, ttl, json.dumps(payload, default=str))
+            client.eval(_RELEASE_SCRIPT, 1, f"{CLAIM_PREFIX}{name}", token)
         except redis.RedisError as exc:
-            logger.warning("redis set failed (%s): %s", key, exc)
+            self._failed("release", name, exc)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import select
+
+from src.preprocessing.features import LAGS, add_returns, add_time_features
+from src.storage.db import session_scope
+from src.storage.models import Candle
+
+RET_COLS = [f"ret_{k}" for k in LAGS]
+LOOKBACK = max(LAGS)
+BUFFER_SIZE = 512
+
+_COLUMNS = ["dt", "open", "close"]
+
+
+def _frame(rows) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=_COLUMNS)
+    df["dt"] = pd.to_datetime(df["dt"])
+    return df
+
+
+def fetch_candles(until: datetime | None = None, limit: int | None = None) -> pd.DataFrame:
+    # limit — последние N свечей до until включительно (хронологический порядок сохраняется)
+    stmt = select(Candle.dt, Candle.open, Candle.close)
+    if until is not None:
+        stmt = stmt.where(Candle.dt <= until)
+    if limit is not None:
+        stmt = stmt.order_by(Candle.dt.desc()).limit(limit)
+    else:
+        stmt = stmt.order_by(Candle.dt)
+    with session_scope() as s:
+        rows = s.execute(stmt).all()
+    if limit is not None:
+        rows = rows[::-1]
+    return _frame(rows)
+
+
+def fetch_candles_since(since: datetime) -> pd.DataFrame:
+    with session_scope() as s:
+        rows = s.execute(
+            select(Candle.dt, Candle.open, Candle.close)
+            .where(Candle.dt >= since)
+            .order_by(Candle.dt)
+        ).all()
+    return _frame(rows)
+
+
+def enrich(candles: pd.DataFrame) -> pd.DataFrame:
+    return add_time_features(add_returns(candles.copy()))
+
+
+def candle_row_at(candles: pd.DataFrame, t: datetime) -> pd.Series:
+    enriched = enrich(candles)
+    mask = enriched["dt"] == pd.Timestamp(t)
+    if not mask.any():
+        raise SystemExit(
+            f"Нет свечи на момент {t} в БД (последняя: {enriched['dt'].max()})"
+        )
+    row = enriched.loc[mask].iloc[0]
+    for col in RET_COLS:
+        if pd.isna(row[col]):
+            raise SystemExit(f"Нет валидного {col} на {t} (мало истории)")
+    return row
+
+
+# Хвост таблицы candles в памяти процесса с уже посчитанными ret_*.
+# Обновляется с последней известной свечи (она могла ещё не закрыться) и дальше;
+# всё, что старше буфера, читается из БД запросом на LOOKBACK + 1 строк.
+class CandleBuffer:
+    def __init__(self, size: int = BUFFER_SIZE) -> None:
+        if size <= LOOKBACK:
+            raise ValueError(f"size должен быть > {LOOKBACK}, получено {size}")
+        self._size = size
+        self._frame: pd.DataFrame | None = None
+        self._lock = threading.Lock()
+
+    def _refresh_locked(self) -> pd.DataFrame:
+        if self._frame is None or self._frame.empty:
+            raw = fetch_candles(limit=self._size)
+        else:
+            last_dt = self._frame["dt"].iloc[-1]
+            fresh = fetch_candles_since(last_dt.to_pydatetime())
+            kept = self._frame.loc[self._frame["dt"] < last_dt, _COLUMNS]
+            raw = pd.concat([kept, fresh], ignore_index=True).tail(self._size)
+        self._frame = enrich(raw.reset_index(drop=True))
+        return self._frame
+
+    def refresh(self) -> pd.DataFrame:
+        with self._lock:
+            return self._refresh_locked()
+
+    def row_at(self, t: datetime) -> pd.Series:
+        return self._row_from(self.refresh(), t)
+
+    def rows_at(self, dts: list[datetime]) -> dict[datetime, pd.Series | SystemExit]:
+        # одно обновление буфера на все dt; ошибки — по каждому dt отдельно
+        frame = self.refresh()
+        rows: dict[datetime, pd.Series | SystemExit] = {}
+        for t in dts:
+            try:
+                rows[t] = self._row_from(frame, t)
+            except SystemExit as exc:
+                rows[t] = exc
+        return rows
+
+    @staticmethod
+    def _row_from(frame: pd.DataFrame, t: datetime) -> pd.Series:
+        ts = pd.Timestamp(t)
+        if frame.empty:
+            raise SystemExit(f"Нет свечи на момент {t} в БД (таблица candles пуста)")
+
+        valid = frame[RET_COLS].notna().all(axis=1)
+        first_valid = frame.loc[valid, "dt"].min() if valid.any() else None
+        if first_valid is not None and ts >= first_valid:
+            mask = frame["dt"] == ts
+            if not mask.any():
+                raise SystemExit(
+                    f"Нет свечи на момент {t} в БД (последняя: {frame['dt'].max()})"
+                )
+            return frame.loc[mask].iloc[0]
+
+        return candle_row_at(fetch_candles(until=t, limit=LOOKBACK + 1), t)
+
+    def latest_valid_dts(self, k: int, until: datetime) -> list[datetime]:
+        frame = self.refresh()
+        frame = frame[frame["dt"] <= pd.Timestamp(until)]
+        eligible = frame[frame[RET_COLS].notna().all(axis=1)]
+        if len(eligible) < k:
+            # буфера не хватило на k точек — читаем ровно k + LOOKBACK строк
+            enriched = enrich(fetch_candles(until=until, limit=k + LOOKBACK))
+            eligible = enriched[enriched[RET_COLS].notna().all(axis=1)]
+        if eligible.empty:
+            raise SystemExit("Нет свечей с валидным lookback (мало истории)")
+        tail = eligible["dt"].sort_values(ascending=False).head(k)
+        return [ts.to_pydatetime() for ts in tail]
@@ -1,25 +1,22 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from pathlib import Path
+from typing import Any
 
 import numpy as np
-import pandas as pd
-import torch
 
+from src.common.tracing import stage
 from src.inference.worker import (
-    MAX_NEWS_IN_WINDOW,
     InferenceArtifacts,
-    _candle_row_at,
-    _ner_aggregates,
-    fetch_candles,
-    fetch_news,
-    news_window,
+    forward_batch,
+    prepare_input,
 )
-from src.ml.dataset import EMBED_DIM, build_numeric_row, embed_news
-from src.preprocessing.ner import extract_for_row
-from src.preprocessing.text_clean import clean, normalize_title
+from src.ml.dataset import EMBED_DIM
+from src.ml.lstm_numpy import NumpyNewsLSTM
+
+# воркер считает и кэширует максимум, API режет до запрошенных top_news/top_companies
+TOP_MAX = 20
 
 
 @dataclass
@@ -49,58 +46,81 @@ class ExplainResult:
     top_companies: list[CompanyContribution]
 
 
-def _build_news_window(news: pd.DataFrame) -> list[dict]:
-    if news.empty:
-        return []
-    news = news.copy()
-    news["title"] = news["title"].fillna("").astype(str)
-    news["body"] = news["body"].fillna("").astype(str)
-    items = []
-    for _, row in news.iterrows():
-        title_norm = normalize_title(row["title"])
-        body_raw = row["body"]
-        cleaned = clean(title_norm + " " + body_raw)
-        if not cleaned:
-            continue
-        display = (title_norm or body_raw).strip().replace("\n", " ")
-        if not display:
-            display = cleaned
-        items.append({"display": display[:160], "cleaned": cleaned})
-    return items
-
-
-def _predict_batch(
+def to_payload(result: ExplainResult) -> dict[str, Any]:
+    payload = asdict(result)
+    for k in ("dt", "window_start", "window_end"):
+        payload[k] = payload[k].isoformat()
+    return payload
+
+
+def _leave_one_out(
     artifacts: InferenceArtifacts,
-    text_embs_per_news: list[np.ndarray],
+    news_vecs: np.ndarray,
     numeric_scaled: np.ndarray,
-    drop_index: list[int | None],
 ) -> np.ndarray:
-    n_news = len(text_embs_per_news)
-    full = np.stack(text_embs_per_news) if n_news else np.zeros((0, EMBED_DIM), dtype=np.float32)
-
-    B = len(drop_index)
-    max_len = max(1, n_news)
-    text_emb = torch.zeros(B, max_len, EMBED_DIM, dtype=torch.float32)
-    lengths = torch.zeros(B, dtype=torch.long)
-
-    for b, drop_i in enumerate(drop_index):
-        if n_news == 0:
-            continue
-        if drop_i is None:
-            seq = full
-        else:
-            seq = np.delete(full, drop_i, axis=0)
-        seq_len = seq.shape[0]
-        lengths[b] = seq_len
-        if seq_len:
-            text_emb[b, :seq_len] = torch.from_numpy(seq)
-
-    numeric = torch.from_numpy(np.repeat(numeric_scaled, B, axis=0))
+    # [y_base, y_без_0, ..., y_без_{n-1}]. Прогон без i-й новости совпадает с базовым
+    # на шагах 0..i-1, поэтому храним (h, c) базового прогона после каждого шага
+    # и доигрываем только хвост i+1..n-1: n + n(n-1)/2 шагов LSTM вместо ~n².
+    if isinstance(artifacts.model, NumpyNewsLSTM):
+        return _leave_one_out_numpy(artifacts.model, news_vecs, numeric_scaled)
+    import torch
+    from torch.nn.utils.rnn import pack_padded_sequence
+
+    model = artifacts.model
+    device = artifacts.device
+    n = news_vecs.shape[0]
+    x = torch.from_numpy(np.ascontiguousarray(news_vecs, dtype=np.float32)).to(device)
+    numeric = torch.from_numpy(np.ascontiguousarray(numeric_scaled, dtype=np.float32)).to(device)
 
     with torch.no_grad():
-        text_emb = text_emb.to(artifacts.device)
-        numeric = numeric.to(artifacts.device)
-        return artifacts.model(text_emb, lengths, numeric).cpu().numpy()
+        zeros = torch.zeros(model.num_layers, 1, model.hidden_size, device=device)
+        h_steps, c_steps = [zeros], [zeros]
+        for k in range(n):
+            _, (h, c) = model.lstm(x[k:k + 1].unsqueeze(0), (h_steps[-1], c_steps[-1]))
+            h_steps.append(h)
+            c_steps.append(c)
+
+        # стартовое состояние для «без i» — после шагов 0..i-1
+        h0 = torch.cat(h_steps[:n], dim=1)
+        c0 = torch.cat(c_steps[:n], dim=1)
+        lengths = torch.arange(n - 1, -1, -1)
+        h_last = h0[-1].clone()
+        nonempty = lengths > 0
+        if nonempty.any():
+            suffix = torch.zeros(n, n - 1, x.size(1), device=device)
+            for i in range(n - 1):
+                suffix[i, :n - 1 - i] = x[i + 1:]
+            packed = pack_padded_sequence(
+                suffix[nonempty], lengths[nonempty], batch_first=True, enforce_sorted=False,
+            )
+            _, (h_n, _) = model.lstm(
+                packed, (h0[:, nonempty].contiguous(), c0[:, nonempty].contiguous())
+            )
+            h_last[nonempty] = h_n[-1]
+
+        h_all = model.head_dropout(torch.cat([h_steps[n][-1], h_last]))
+        y = model.head(torch.cat([h_all, numeric.expand(n + 1, -1)], dim=1)).squeeze(-1)
+    return y.cpu().numpy()
+
+
+def _leave_one_out_numpy(
+    model: NumpyNewsLSTM, news_vecs: np.ndarray, numeric_scaled: np.ndarray,
+) -> np.ndarray:
+    n = news_vecs.shape[0]
+    x = np.ascontiguousarray(news_vecs, dtype=np.float32)
+    h_steps = np.zeros((n + 1, model.hidden_size), dtype=np.float32)
+    c_steps = np.zeros_like(h_steps)
+    for k in range(n):
+        h, c = model.run(x[None, k:k + 1], np.ones(1), h_steps[k:k + 1], c_steps[k:k + 1])
+        h_steps[k + 1], c_steps[k + 1] = h[0], c[0]
+
+    # хвосты нулевой длины (i = n-1) run возвращает как есть — это состояние после 0..n-2
+    suffix = np.zeros((n, max(n - 1, 1), x.shape[1]), dtype=np.float32)
+    for i in range(n - 1):
+        suffix[i, :n - 1 - i] = x[i + 1:]
+    h_last, _ = model.run(suffix, np.arange(n - 1, -1, -1), h_steps[:n], c_steps[:n])
+    h_all = np.concatenate([h_steps[n:], h_last])
+    return model.head(h_all, np.repeat(numeric_scaled, n + 1, axis=0))
 
 
 def explain_at(
@@ -110,59 +130,35 @@ def explain_at(
     top_companies: int = 5,
     now: datetime | None = None,
 ) -> ExplainResult:
-    candles = fetch_candles(until=t)
-    candle_row = _candle_row_at(candles, t)
-
-    window_start, window_end, status = news_window(t, now)
-    news = fetch_news(window_start, window_end)
-    items = _build_news_window(news)
-    if len(items) > MAX_NEWS_IN_WINDOW:
-        items = items[-MAX_NEWS_IN_WINDOW:]
-
-    cleaned_texts = [it["cleaned"] for it in items]
-    ner_agg = _ner_aggregates(cleaned_texts, artifacts.ner)
-    feature_row = {**candle_row.to_dict(), **ner_agg}
-    numeric_raw = build_numeric_row(feature_row).reshape(1, -1)
-    numeric_scaled = artifacts.scaler.transform(numeric_raw).astype(np.float32)
-
-    text_embs = [embed_news(text, artifacts.kv) for text in cleaned_texts]
+    with stage("explain_prepare"):
+        inp = prepare_input(artifacts, t, now)
+    items = inp.items
+    news_vecs = inp.news_vecs
+    no_news = np.zeros((0, EMBED_DIM), dtype=np.float32)
+    no_news_pred = forward_batch(artifacts, [no_news], inp.numeric_scaled)[0]
 
     if not items:
-        no_news_pred = _predict_batch(artifacts, [], numeric_scaled, [None])[0]
         return ExplainResult(
             dt=t,
             y_pred=float(no_news_pred),
             y_no_news=float(no_news_pred),
-            market_status=status,
-            window_start=window_start,
-            window_end=window_end,
+            market_status=inp.market_status,
+            window_start=inp.window_start,
+            window_end=inp.window_end,
             top_news=[],
             top_companies=[],
         )
 
-    preds = _predict_batch(
-        artifacts,
-        text_embs,
-        numeric_scaled,
-        [None, *range(len(items))],
-    )
+    with stage("explain_loo"):
+        preds = _leave_one_out(artifacts, news_vecs, inp.numeric_scaled)
     y_base = float(preds[0])
-
-    no_news_pred = _predict_batch(artifacts, [], numeric_scaled, [None])[0]
     y_no_news = float(no_news_pred)
 
     contribs_per_news = []
     for i, item in enumerate(items):
         y_without = float(preds[1 + i])
-        tickers, *_ = extract_for_row(
-            item["cleaned"],
-            artifacts.ner.pattern,
-            artifacts.ner.variant_to_ticker,
-            artifacts.ner.weights,
-            artifacts.ner.top_set,
-        )
         contribs_per_news.append(
-            {"display": item["display"], "contribution": y_base - y_without, "tickers": tickers}
+            {"display": item.display, "contribution": y_base - y_without, "tickers": item.tickers}
         )
 
     news_sorted = sorted(contribs_per_news, key=lambda d: abs(d["contribution"]), reverse=True)
@@ -195,9 +191,9 @@ def explain_at(
         dt=t,
         y_pred=y_base,
         y_no_news=y_no_news,
-        market_status=status,
-        window_start=window_start,
-        window_end=window_end,
+        market_status=inp.market_status,
+        window_start=inp.window_start,
+        window_end=inp.window_end,
         top_news=top_news_list,
         top_companies=top_companies_list,
     )
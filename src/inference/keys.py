@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import hashlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import func, select
+
+from src.common.time_utils import market_is_open, now_msk
+from src.common.tracing import stage
+from src.config import settings
+from src.storage.db import session_scope
+from src.storage.models import News
+
+# Ключи кэша и версии артефактов без torch/gensim: их импортируют API и ingest,
+# которым сама модель не нужна.
+
+WINDOW_HOURS = 4
+
+
+def news_window(t: datetime, now: datetime | None = None) -> tuple[datetime, datetime, str]:
+    now = now or now_msk()
+    base_start = t - timedelta(hours=WINDOW_HOURS)
+    if market_is_open(now):
+        return base_start, t, "open"
+    return base_start, now, "closed"
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    # размер + sha1 содержимого: в отличие от mtime, совпадает у одного и того же
+    # файла в разных контейнерах (копия в образе vs bind mount)
+    h = hashlib.sha1()
+    with path.open("rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return f"{path.stat().st_size}:{h.hexdigest()}"
+
+
+def weights_path(lstm_path: Path, engine: str) -> Path:
+    # numpy-движок берёт <name>.npz (export_npz), если он лежит рядом с .pt
+    npz_path = lstm_path.with_suffix(".npz")
+    if engine == "numpy" and npz_path.exists():
+        return npz_path
+    return lstm_path
+
+
+def model_version(
+    features: str,
+    lstm_path: Path = settings.paths.lstm,
+    scaler_path: Path = settings.paths.scaler,
+    engine: str | None = None,
+) -> str:
+    # Версия всего прогноза: движок + реально загружаемые веса (и их конфиг) + скейлер
+    # + версия признаков новостей. torch, int8 и numpy дают разные числа — разные ключи.
+    # Считает её только тот, кто грузит модель (воркер, backfill); API берёт её у воркера.
+    engine = engine or settings.inference_engine
+    h = hashlib.sha1(f"features={features}|engine={engine}".encode())
+    for path in (weights_path(lstm_path, engine), lstm_path.with_suffix(".json"), scaler_path):
+        if path.exists():
+            h.update(f"|{path.name}:{file_digest(path)}".encode())
+    return h.hexdigest()[:16]
+
+
+def window_fingerprint(start: datetime, end: datetime) -> str:
+    # Отпечаток состава окна: новости только дописываются, так что count + max(id)
+    # меняется при любой новой новости в [start, end).
+    with stage("fingerprint"), session_scope() as s:
+        count, max_id = s.execute(
+            select(func.count(News.id), func.max(News.id)).where(
+                News.ts >= start, News.ts < end
+            )
+        ).one()
+    return f"{count}-{max_id or 0}"
+
+
+def window_fingerprints(windows: list[tuple[datetime, datetime]]) -> list[str]:
+    # те же отпечатки для пачки окон (/history, прогрев): один проход по индексу ts
+    # за объединённый диапазон, счёт и max(id) по окнам — в памяти
+    if len(windows) <= 1:
+        return [window_fingerprint(start, end) for start, end in windows]
+    lo = min(start for start, _ in windows)
+    hi = max(end for _, end in windows)
+    with stage("fingerprint"), session_scope() as s:
+        rows = s.execute(
+            select(News.ts, News.id).where(News.ts >= lo, News.ts < hi).order_by(News.ts)
+        ).all()
+    ts = [row.ts for row in rows]
+    ids = [row.id for row in rows]
+    fingerprints = []
+    for start, end in windows:
+        i, j = bisect_left(ts, start), bisect_left(ts, end)
+        fingerprints.append(f"{j - i}-{max(ids[i:j], default=0)}")
+    return fingerprints
+
+
+def cache_keys(
+    dts: list[datetime], version: str | None, now: datetime | None = None,
+) -> list[str]:
+    # Ключ результата: dt + версия модели + отпечаток окна новостей. Прогноз (и explain)
+    # — функция ровно этого: свеча dt закрыта, а окно при закрытом рынке хоть и тянется
+    # до now, но без новых новостей его состав не меняется — ключ тот же, кэш живёт.
+    now = now or now_msk()
+    windows = [news_window(t, now)[:2] for t in dts]
+    return [
+        format_cache_key(t, version, fingerprint)
+        for t, fingerprint in zip(dts, window_fingerprints(windows), strict=True)
+    ]
+
+
+def format_cache_key(t: datetime, version: str | None, fingerprint: str) -> str:
+    return f"{t.isoformat()}:{version}:{fingerprint}"
+
+
+def cache_key(t: datetime, version: str | None, now: datetime | None = None) -> str:
+    return cache_keys([t], version, now)[0]
+
+
+def explain_cache_key(t: datetime, version: str | None, now: datetime | None = None) -> str:
+    # тот же ключ, что у прогноза: пока dt, модель и состав окна те же — объяснение тоже
+    return cache_key(t, version, now)
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from gensim.models import KeyedVectors
+
+from src.common.tracing import stage
+from src.inference.keys import file_digest
+from src.ml.dataset import embed_token_ids, tokenize_batch
+from src.preprocessing.ner import build_matcher, extract_for_row, load_tickers, top_tickers
+from src.preprocessing.text_clean import clean, normalize_title
+
+DEFAULT_TOP_N = 5
+DISPLAY_MAX_LEN = 160
+
+logger = logging.getLogger("inference.news")
+
+
+@dataclass
+class NerContext:
+    pattern: re.Pattern
+    variant_to_ticker: dict[str, str]
+    weights: dict[str, float]
+    names: dict[str, str]
+    top_set: set[str]
+
+
+@dataclass(frozen=True)
+class NewsFeatures:
+    cleaned: str
+    display: str
+    tickers: list[str]
+    org_weight: float
+    n_components: int
+    has_top: bool
+    token_ids: np.ndarray
+    embedding: np.ndarray
+
+
+def build_ner_context(tickers_path: Path, top_n: int = DEFAULT_TOP_N) -> NerContext:
+    tickers = load_tickers(tickers_path)
+    pattern, variant_to_ticker = build_matcher(tickers)
+    return NerContext(
+        pattern=pattern,
+        variant_to_ticker=variant_to_ticker,
+        weights={t: float(info.get("weight", 0.0)) for t, info in tickers.items()},
+        names={t: info.get("name", t) for t, info in tickers.items()},
+        top_set=top_tickers(tickers, top_n),
+    )
+
+
+def feature_version(w2v_path: Path, tickers_path: Path, top_n: int = DEFAULT_TOP_N) -> str:
+    # Признаки новости зависят только от W2V и словаря тикеров; LSTM тут ни при чём.
+    # Хэшируем содержимое: ingest и воркер должны получить одну версию на одних данных.
+    h = hashlib.sha1(f"top_n={top_n}".encode())
+    for path in (w2v_path, Path(f"{w2v_path}.vectors.npy"), tickers_path):
+        if path.exists():
+            h.update(f"|{path.name}:{file_digest(path)}".encode())
+    return h.hexdigest()[:16]
+
+
+def load_kv(w2v_path: Path, mmap: bool = True) -> KeyedVectors:
+    # mmap="r": матрица векторов (<kv>.vectors.npy) отображается read-only, и все
+    # процессы на хосте читают одни и те же страницы page cache вместо своей копии.
+    vectors_path = Path(f"{w2v_path}.vectors.npy")
+    if mmap and not vectors_path.exists():
+        logger.warning("w2v: нет %s — векторы внутри %s, mmap невозможен", vectors_path, w2v_path)
+    kv = KeyedVectors.load(str(w2v_path), mmap="r" if mmap else None)
+    logger.info(
+        "w2v: %s загружен (%d слов, mmap=%s, shared=%s)",
+        w2v_path, len(kv), mmap, isinstance(kv.vectors, np.memmap),
+    )
+    return kv
+
+
+def process_news_batch(
+    titles: Sequence, bodies: Sequence, kv: KeyedVectors, ner: NerContext,
+) -> list[NewsFeatures]:
+    cleaned_all, display_all = [], []
+    with stage("clean"):
+        for title, body in zip(titles, bodies, strict=True):
+            title_norm = normalize_title(title)
+            body_raw = body or ""
+            cleaned = clean(title_norm + " " + body_raw)
+            cleaned_all.append(cleaned)
+            display_all.append((title_norm or body_raw).strip().replace("\n", " ") or cleaned)
+
+    with stage("embed"):
+        ids, offsets = tokenize_batch(cleaned_all, kv)
+        embeddings = embed_token_ids(ids, offsets, kv.vectors)
+
+    with stage("ner"):
+        ner_rows = [
+            extract_for_row(cleaned, ner.pattern, ner.variant_to_ticker, ner.weights, ner.top_set)
+            for cleaned in cleaned_all
+        ]
+
+    items = []
+    for i, (cleaned, (tickers, weight, n_components, has_top)) in enumerate(
+        zip(cleaned_all, ner_rows, strict=True)
+    ):
+        items.append(NewsFeatures(
+            cleaned=cleaned,
+            display=display_all[i][:DISPLAY_MAX_LEN],
+            tickers=tickers,
+            org_weight=weight,
+            n_components=n_components,
+            has_top=has_top,
+            token_ids=ids[offsets[i]:offsets[i + 1]].astype(np.int32),
+            embedding=embeddings[i].copy(),
+        ))
+    return items
+
+
+def to_record(feats: NewsFeatures) -> dict[str, Any]:
+    return {
+        "cleaned": feats.cleaned,
+        "display": feats.display,
+        "tickers": ",".join(feats.tickers),
+        "org_weight": float(feats.org_weight),
+        "n_components": int(feats.n_components),
+        "has_top": bool(feats.has_top),
+        "token_ids": feats.token_ids.astype(np.int32).tobytes(),
+        "embedding": feats.embedding.astype(np.float32).tobytes(),
+    }
+
+
+def from_record(rec: dict[str, Any]) -> NewsFeatures:
+    return NewsFeatures(
+        cleaned=rec["cleaned"],
+        display=rec["display"],
+        tickers=rec["tickers"].split(",") if rec["tickers"] else [],
+        org_weight=float(rec["org_weight"]),
+        n_components=int(rec["n_components"]),
+        has_top=bool(rec["has_top"]),
+        token_ids=np.frombuffer(rec["token_ids"], dtype=np.int32),
+        embedding=np.frombuffer(rec["embedding"], dtype=np.float32),
+    )
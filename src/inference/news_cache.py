@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+from src.config import settings
+from src.inference.news import NewsFeatures
+
+NewsKey = tuple[str, str]
+
+
+class NewsFeatureCache:
+    # LRU по (source, source_id): новость в БД не меняется после вставки,
+    # поэтому инвалидация нужна только при смене артефактов (кэш живёт в InferenceArtifacts).
+    def __init__(self, maxsize: int | None = None) -> None:
+        self._maxsize = maxsize if maxsize is not None else settings.news_cache_size
+        self._items: OrderedDict[NewsKey, NewsFeatures] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: NewsKey) -> NewsFeatures | None:
+        with self._lock:
+            feats = self._items.get(key)
+            if feats is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return feats
+
+    def put(self, key: NewsKey, feats: NewsFeatures) -> None:
+        if self._maxsize <= 0:
+            return
+        feats.embedding.flags.writeable = False
+        with self._lock:
+            self._items[key] = feats
+            self._items.move_to_end(key)
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
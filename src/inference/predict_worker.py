@@ -2,23 +2,33 @@ from __future__ import annotations
 
 import argparse
 import logging
+import signal
+import threading
 from datetime import datetime
 from typing import Any
 
-from src.inference.cache import KEY_PREFIX, PredictionCache
-from src.inference.queue import consume_loop
+from prometheus_client import start_http_server
+
+from src.common.time_utils import now_msk
+from src.common.tracing import stage
+from src.config import settings
+from src.inference.cache import PredictionCache
+from src.inference.explain import TOP_MAX, explain_at, to_payload
+from src.inference.keys import cache_keys, explain_cache_key
+from src.inference.queue import EXPLAIN_QUEUE_NAME, QUEUE_NAME, consume_loop
 from src.inference.worker import (
+    ENGINES,
     PredictionResult,
     load_artifacts,
-    predict_at,
+    predict_batch,
+    prepare_inputs,
 )
+from src.storage.writer import PredictionWriter
 
 logger = logging.getLogger("inference.predict_worker")
 
-RESULT_PREFIX = "predict:result:"
-
 
-def _to_payload(result: PredictionResult) -> dict[str, Any]:
+def _to_payload(result: PredictionResult, model_version: str | None = None) -> dict[str, Any]:
     return {
         "dt": result.dt.isoformat(sep="T"),
         "y_pred": result.y_pred,
@@ -33,34 +43,116 @@ def _to_payload(result: PredictionResult) -> dict[str, Any]:
         "market_status": result.market_status,
         "window_start": result.window_start.isoformat(),
         "window_end": result.window_end.isoformat(),
+        "model_version": model_version,
     }
 
 
-def _make_handler(artifacts, cache: PredictionCache):
-    def handler(message: dict) -> None:
-        request_id = message["request_id"]
-        dt = datetime.fromisoformat(message["dt"])
-        logger.info("predict req=%s dt=%s", request_id, dt)
-        try:
-            result = predict_at(artifacts, dt)
-        except SystemExit as exc:
-            logger.warning("predict req=%s failed: %s", request_id, exc)
-            cache.set_raw(f"{RESULT_PREFIX}{request_id}", {"error": str(exc)})
-            return
-
-        payload = _to_payload(result)
-        cache.set_raw(f"{RESULT_PREFIX}{request_id}", payload)
-        cache.set(dt.isoformat(), payload)
-        logger.info(
-            "predict req=%s y=%.4f%% n_news=%d", request_id, result.y_pred * 100, result.n_news
-        )
+def _make_handler(artifacts, cache: PredictionCache, writer: PredictionWriter):
+    def handler(messages: list[dict]) -> dict[str, dict]:
+        # Задача — один dt ("dt") или пачка ("dts", от /history). Все dt всех задач
+        # считаем вместе: один prepare_inputs и один forward, одинаковые dt — один раз.
+        # Ответы по request_id consume_loop отправляет в reply_to задач.
+        requested: dict[str, list[datetime]] = {}
+        for message in messages:
+            dts = [datetime.fromisoformat(dt) for dt in message.get("dts") or [message["dt"]]]
+            requested[message["request_id"]] = dts
+        unique = list(dict.fromkeys(dt for dts in requested.values() for dt in dts))
+        logger.info("predict batch=%d (уникальных dt: %d)", len(messages), len(unique))
+
+        # отпечатки окон — до чтения новостей: если новость придёт между ними, результат
+        # (уже с ней) ляжет под старый ключ, который и так больше никто не спросит
+        now = now_msk()
+        keys = dict(zip(unique, cache_keys(unique, artifacts.model_version, now), strict=True))
+        inputs, errors = prepare_inputs(artifacts, unique, now=now)
+        by_dt: dict[datetime, dict] = {dt: {"error": error} for dt, error in errors.items()}
+        for dt, error in errors.items():
+            logger.warning("predict dt=%s failed: %s", dt, error)
+
+        payloads = []
+        for result in predict_batch(artifacts, inputs):
+            payload = _to_payload(result, artifacts.model_version)
+            by_dt[result.dt] = payload
+            payloads.append(payload)
+            with stage("cache_write"):
+                cache.set(keys[result.dt], payload)
+                cache.set_stale(
+                    payload["dt"], artifacts.model_version, payload, settings.predict_stale_ttl_sec,
+                )
+            logger.info(
+                "predict dt=%s y=%.4f%% n_news=%d", result.dt, result.y_pred * 100, result.n_news,
+            )
+        # в Postgres — write-behind пачками, ответ в reply_to не ждёт записи
+        writer.add(payloads)
+        # версия для ключей API; повторяем с каждой пачкой — переживает рестарт Redis
+        cache.publish_model_version(artifacts.model_version)
+
+        replies: dict[str, dict] = {}
+        for message in messages:
+            request_id = message["request_id"]
+            if "dts" in message:
+                replies[request_id] = {
+                    "items": [by_dt[dt] for dt in requested[request_id]],
+                    "model_version": artifacts.model_version,
+                }
+            else:
+                replies[request_id] = by_dt[requested[request_id][0]]
+        return replies
+
+    return handler
+
+
+def _on_sigterm(signum, frame) -> None:
+    # docker stop → тот же путь, что Ctrl+C: consume_loop выходит, writer сбрасывает буфер
+    raise KeyboardInterrupt
+
+
+def _make_explain_handler(artifacts, cache: PredictionCache):
+    def handler(messages: list[dict]) -> dict[str, dict]:
+        # leave-one-out тяжёлый — dt считаем по одному, одинаковые dt в пачке один раз
+        by_dt: dict[str, list[str]] = {}
+        for message in messages:
+            by_dt.setdefault(message["dt"], []).append(message["request_id"])
+
+        replies: dict[str, dict] = {}
+        for dt_iso, request_ids in by_dt.items():
+            t = datetime.fromisoformat(dt_iso)
+            now = now_msk()
+            key = cache.explain_key(explain_cache_key(t, artifacts.model_version, now))
+            payload = cache.get_raw(key, settings.explain_cache_ttl_sec)
+            if payload is None:
+                try:
+                    result = explain_at(
+                        artifacts, t, top_news=TOP_MAX, top_companies=TOP_MAX, now=now,
+                    )
+                except SystemExit as exc:
+                    logger.warning("explain req=%s failed: %s", ",".join(request_ids), exc)
+                    payload = {"error": str(exc)}
+                else:
+                    payload = to_payload(result)
+                    with stage("cache_write"):
+                        cache.set_raw(key, payload, settings.explain_cache_ttl_sec)
+                    logger.info(
+                        "explain req=%s dt=%s y=%.4f%% y_no_news=%.4f%%",
+                        ",".join(request_ids), t, result.y_pred * 100, result.y_no_news * 100,
+                    )
+            for request_id in request_ids:
+                replies[request_id] = payload
+        return replies
 
     return handler
 
 
 def parse_args() -> argparse.Namespace:
-    p = argparse.ArgumentParser(description="Consumer для predict_tasks из RabbitMQ")
+    p = argparse.ArgumentParser(
+        description="Consumer для predict_tasks и explain_tasks из RabbitMQ",
+    )
     p.add_argument("--device", default=None)
+    p.add_argument("--engine", choices=ENGINES, default=None)
+    p.add_argument("--batch-size", type=int, default=settings.predict_batch_size)
+    p.add_argument("--batch-wait-ms", type=int, default=settings.predict_batch_wait_ms)
+    p.add_argument(
+        "--metrics-port", type=int, default=settings.metrics_port, help="/metrics; 0 — выключить",
+    )
     return p.parse_args()
 
 
@@ -71,12 +163,32 @@ def main() -> None:
         format="%(asctime)s %(name)s %(levelname)s %(message)s",
     )
     logger.info("predict-worker: загружаю артефакты")
-    artifacts = load_artifacts(device=args.device)
+    artifacts = load_artifacts(device=args.device, engine=args.engine)
     cache = PredictionCache()
     if not cache.available:
-        raise SystemExit("Redis недоступен — predict-worker не может писать результаты")
-    handler = _make_handler(artifacts, cache)
-    consume_loop(handler)
+        logger.warning("predict-worker: Redis недоступен — кэширую локально, переподключаюсь")
+    cache.publish_model_version(artifacts.model_version)
+    logger.info("predict-worker: версия модели %s", artifacts.model_version)
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+        logger.info("predict-worker: /metrics на порту %d", args.metrics_port)
+    writer = PredictionWriter()
+    batching = {"max_batch": args.batch_size, "max_wait_ms": args.batch_wait_ms}
+    # explain (leave-one-out) — в своём потоке со своим соединением: долгий explain
+    # не задерживает пачки прогнозов. Модель, w2v и кэш признаков новостей общие.
+    # Поток daemon: неподтверждённые explain-задачи RabbitMQ вернёт в очередь.
+    threading.Thread(
+        target=consume_loop,
+        args=({EXPLAIN_QUEUE_NAME: _make_explain_handler(artifacts, cache)},),
+        kwargs=batching,
+        name="explain-consumer",
+        daemon=True,
+    ).start()
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    try:
+        consume_loop({QUEUE_NAME: _make_handler(artifacts, cache, writer)}, **batching)
+    finally:
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -2,72 +2,461 @@ from __future__ import annotations
 
 import json
 import logging
+import threading
 import time
 import uuid
-from collections.abc import Callable
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 
 import pika
 
+from src.common import tracing
+from src.common.metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS, WORKER_BATCH_SIZE
+from src.common.tracing import stage
 from src.config import settings
 
 QUEUE_NAME = "predict_tasks"
+EXPLAIN_QUEUE_NAME = "explain_tasks"
+TASK_QUEUES = (QUEUE_NAME, EXPLAIN_QUEUE_NAME)
 RECONNECT_DELAY_SEC = 5
+PUBLISH_CONFIRM_TIMEOUT_SEC = 10
+# как часто consume_loop замеряет глубину очередей (passive queue_declare)
+QUEUE_DEPTH_INTERVAL_SEC = 1.0
 
 logger = logging.getLogger("inference.queue")
 
 
-def _connect() -> pika.BlockingConnection:
-    params = pika.URLParameters(settings.rabbitmq_url)
+def _params(url: str | None = None) -> pika.URLParameters:
+    params = pika.URLParameters(url or settings.rabbitmq_url)
     params.heartbeat = 60
     params.blocked_connection_timeout = 30
-    return pika.BlockingConnection(params)
+    return params
+
 
+def _connect() -> pika.BlockingConnection:
+    return pika.BlockingConnection(_params())
 
-def _declare_queue(channel: pika.adapters.blocking_connection.BlockingChannel) -> None:
-    channel.queue_declare(queue=QUEUE_NAME, durable=True)
 
+def _declare_queues(channel: pika.adapters.blocking_connection.BlockingChannel) -> None:
+    for queue in TASK_QUEUES:
+        channel.queue_declare(queue=queue, durable=True)
 
-def publish_predict_task(dt_iso: str) -> str:
-    request_id = uuid.uuid4().hex
-    conn = _connect()
-    try:
-        channel = conn.channel()
-        _declare_queue(channel)
-        channel.basic_publish(
-            exchange="",
-            routing_key=QUEUE_NAME,
-            body=json.dumps({"request_id": request_id, "dt": dt_iso}),
-            properties=pika.BasicProperties(delivery_mode=2),
+
+@dataclass
+class _PoolChannel:
+    channel: pika.channel.Channel
+    next_tag: int = 1
+    unconfirmed: dict[int, Future] = field(default_factory=dict)
+
+
+class AmqpPublisher:
+    # Одно долгоживущее соединение в собственном IO-потоке (SelectConnection) и пул
+    # каналов в confirm-режиме. publish() брокера не ждёт: сообщения уходят подряд,
+    # а basic.ack (в т.ч. multiple=True на пачку) закрывает их Future'ы.
+    # Очереди объявляются один раз на соединение; после обрыва — переподключение,
+    # неотправленные сообщения уходят в новое, неподтверждённые получают ошибку.
+    def __init__(
+        self,
+        url: str | None = None,
+        channels: int | None = None,
+        queues: Iterable[str] = TASK_QUEUES,
+    ) -> None:
+        self._params = _params(url)
+        self._n_channels = max(1, channels or settings.amqp_publish_channels)
+        self._queues = tuple(queues)
+        self._lock = threading.Lock()
+        self._backlog: deque[tuple[str, bytes, pika.BasicProperties | None, Future]] = deque()
+        self._connection: pika.SelectConnection | None = None
+        self._ready: list[_PoolChannel] = []
+        self._next_channel = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def publish(
+        self, routing_key: str, body: bytes | str, properties: pika.BasicProperties | None = None,
+    ) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="amqp-publisher", daemon=True
+                )
+                self._thread.start()
+            self._backlog.append((routing_key, body, properties, future))
+            conn = self._connection
+        if conn is not None:
+            conn.ioloop.add_callback_threadsafe(self._drain)
+        return future
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            conn = self._connection
+        if conn is not None:
+            conn.ioloop.add_callback_threadsafe(self._close_connection)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    # --- всё ниже выполняется в IO-потоке ---
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            conn = pika.SelectConnection(
+                self._params,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            with self._lock:
+                self._connection = conn
+            conn.ioloop.start()
+            with self._lock:
+                self._connection = None
+            conn.ioloop.close()
+            if not self._stop.is_set():
+                self._stop.wait(RECONNECT_DELAY_SEC)
+        self._fail_backlog(pika.exceptions.ConnectionClosed(0, "publisher closed"))
+
+    def _close_connection(self) -> None:
+        conn = self._connection
+        if conn is not None and not (conn.is_closing or conn.is_closed):
+            conn.close()
+
+    def _on_connection_open(self, conn: pika.SelectConnection) -> None:
+        for _ in range(self._n_channels):
+            conn.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, conn: pika.SelectConnection, exc: BaseException) -> None:
+        logger.warning("publisher: нет соединения с RabbitMQ: %s, retry через %ds",
+                       exc, RECONNECT_DELAY_SEC)
+        conn.ioloop.stop()
+
+    def _on_connection_closed(self, conn: pika.SelectConnection, reason: BaseException) -> None:
+        if not self._stop.is_set():
+            logger.warning("publisher: соединение закрыто: %s", reason)
+        for pooled in self._ready:
+            self._fail_unconfirmed(pooled, reason)
+        self._ready = []
+        conn.ioloop.stop()
+
+    def _on_channel_open(self, channel: pika.channel.Channel) -> None:
+        pooled = _PoolChannel(channel)
+        channel.add_on_close_callback(lambda ch, reason: self._on_channel_closed(pooled, reason))
+        channel.confirm_delivery(
+            ack_nack_callback=lambda frame: self._on_confirm(pooled, frame),
+            callback=lambda _: self._declare(pooled, list(self._queues)),
+        )
+
+    def _declare(self, pooled: _PoolChannel, queues: list[str]) -> None:
+        if not queues:
+            self._ready.append(pooled)
+            self._drain()
+            return
+        pooled.channel.queue_declare(
+            queue=queues[0], durable=True, callback=lambda _: self._declare(pooled, queues[1:]),
         )
-    finally:
-        conn.close()
+
+    def _on_channel_closed(self, pooled: _PoolChannel, reason: BaseException) -> None:
+        if pooled in self._ready:
+            self._ready.remove(pooled)
+        self._fail_unconfirmed(pooled, reason)
+        conn = self._connection
+        if conn is not None and conn.is_open and not self._stop.is_set():
+            logger.warning("publisher: канал закрыт: %s, открываю новый", reason)
+            conn.channel(on_open_callback=self._on_channel_open)
+
+    def _drain(self) -> None:
+        while self._ready:
+            with self._lock:
+                if not self._backlog:
+                    return
+                routing_key, body, properties, future = self._backlog.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue  # вызывающий уже перестал ждать
+            pooled = self._ready[self._next_channel % len(self._ready)]
+            self._next_channel += 1
+            try:
+                pooled.channel.basic_publish(
+                    exchange="", routing_key=routing_key, body=body, properties=properties,
+                )
+            except Exception as exc:
+                future.set_exception(exc)
+                continue
+            pooled.unconfirmed[pooled.next_tag] = future
+            pooled.next_tag += 1
+
+    def _on_confirm(self, pooled: _PoolChannel, frame) -> None:
+        method = frame.method
+        if method.multiple:
+            tags = [t for t in pooled.unconfirmed if t <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        nack = isinstance(method, pika.spec.Basic.Nack)
+        for tag in tags:
+            future = pooled.unconfirmed.pop(tag, None)
+            if future is None:
+                continue
+            if nack:
+                future.set_exception(pika.exceptions.NackError([tag]))
+            else:
+                future.set_result(None)
+
+    @staticmethod
+    def _fail_unconfirmed(pooled: _PoolChannel, exc: BaseException) -> None:
+        # судьба сообщения без ack неизвестна — отдаём ошибку, решает вызывающий
+        for future in pooled.unconfirmed.values():
+            if not future.done():
+                future.set_exception(pika.exceptions.AMQPConnectionError(str(exc)))
+        pooled.unconfirmed.clear()
+
+    def _fail_backlog(self, exc: BaseException) -> None:
+        with self._lock:
+            backlog, self._backlog = self._backlog, deque()
+        for *_, future in backlog:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(exc)
+
+
+_publisher: AmqpPublisher | None = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> AmqpPublisher:
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = AmqpPublisher()
+        return _publisher
+
+
+def close_publisher() -> None:
+    global _publisher
+    with _publisher_lock:
+        publisher, _publisher = _publisher, None
+    if publisher is not None:
+        publisher.close()
+
+
+def _publish_task(
+    queue: str, task: dict, reply_to: str | None, request_id: str | None,
+) -> str:
+    # trace_id — контекст трассировки запроса API (или сам request_id), в заголовках AMQP
+    request_id = request_id or uuid.uuid4().hex
+    future = get_publisher().publish(
+        queue,
+        json.dumps({"request_id": request_id, "published_at": time.time(), **task}),
+        pika.BasicProperties(
+            delivery_mode=2,
+            reply_to=reply_to,
+            correlation_id=request_id,
+            headers={"trace_id": tracing.current_trace_id() or request_id},
+        ),
+    )
+    try:
+        future.result(timeout=PUBLISH_CONFIRM_TIMEOUT_SEC)
+    except TimeoutError as exc:
+        future.cancel()
+        raise pika.exceptions.AMQPConnectionError(
+            f"RabbitMQ не подтвердил публикацию за {PUBLISH_CONFIRM_TIMEOUT_SEC}с"
+        ) from exc
     return request_id
 
 
-def consume_loop(handler: Callable[[dict], None]) -> None:
+def publish_predict_task(
+    dt_iso: str, reply_to: str | None = None, request_id: str | None = None,
+) -> str:
+    return _publish_task(QUEUE_NAME, {"dt": dt_iso}, reply_to, request_id)
+
+
+def publish_predict_batch_task(
+    dt_isos: list[str], reply_to: str | None = None, request_id: str | None = None,
+) -> str:
+    # одна задача на все промахи /history; ответ — {"items": [...]} в порядке dt_isos
+    return _publish_task(QUEUE_NAME, {"dts": dt_isos}, reply_to, request_id)
+
+
+def publish_explain_task(
+    dt_iso: str, reply_to: str | None = None, request_id: str | None = None,
+) -> str:
+    return _publish_task(EXPLAIN_QUEUE_NAME, {"dt": dt_iso}, reply_to, request_id)
+
+
+class ReplyListener:
+    # Эксклюзивная очередь ответов воркера на процесс API, слушается в фоновом потоке.
+    # После переподключения имя очереди меняется: ответы на уже опубликованные
+    # задачи теряются, и такие запросы уходят в таймаут.
+    def __init__(self, on_reply: Callable[[str, dict], None]) -> None:
+        self._on_reply = on_reply
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="amqp-replies", daemon=True)
+        self.queue_name: str | None = None
+
+    def start(self, timeout: float = 10.0) -> None:
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            logger.warning("replies: очередь ответов не готова за %.0fс", timeout)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _on_message(self, ch, method, properties, body) -> None:
+        if not properties.correlation_id:
+            return
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            logger.warning("replies: невалидный ответ %r", body[:200])
+            return
+        self._on_reply(properties.correlation_id, payload)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                conn = _connect()
+                channel = conn.channel()
+                declared = channel.queue_declare(queue="", exclusive=True, auto_delete=True)
+                channel.basic_consume(
+                    queue=declared.method.queue,
+                    on_message_callback=self._on_message,
+                    auto_ack=True,
+                )
+                self.queue_name = declared.method.queue
+                self._ready.set()
+                logger.info("replies: слушаю %s", self.queue_name)
+                while not self._stop.is_set():
+                    conn.process_data_events(time_limit=1)
+                conn.close()
+            except pika.exceptions.AMQPError as exc:
+                self.queue_name = None
+                logger.warning("replies: AMQP ошибка %s, retry через %ds", exc, RECONNECT_DELAY_SEC)
+                self._stop.wait(RECONNECT_DELAY_SEC)
+        self.queue_name = None
+
+
+def consume_loop(
+    handlers: dict[str, Callable[[list[dict]], dict[str, dict] | None]],
+    max_batch: int | None = None,
+    max_wait_ms: int | None = None,
+) -> None:
+    # handlers — обработчик на каждую очередь задач (predict_tasks, explain_tasks).
+    # Копим до max_batch сообщений, но ждём не дольше max_wait_ms с первого в пачке;
+    # пачка делится по очередям, каждая часть уходит своему handler'у.
+    # Ошибки отдельных задач handler обрабатывает сам; исключение наружу — nack его части.
+    # handler возвращает ответы по request_id — они уходят в reply_to задач.
+    max_batch = max(1, max_batch or settings.predict_batch_size)
+    max_wait = (max_wait_ms if max_wait_ms is not None else settings.predict_batch_wait_ms) / 1000
     while True:
         try:
             conn = _connect()
             channel = conn.channel()
-            _declare_queue(channel)
-            channel.basic_qos(prefetch_count=1)
-
-            def on_message(ch, method, properties, body):
-                payload = None
-                try:
-                    payload = json.loads(body)
-                    handler(payload)
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                except Exception:
-                    logger.exception("worker: ошибка обработки %s", payload)
-                    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-
-            channel.basic_consume(queue=QUEUE_NAME, on_message_callback=on_message)
-            logger.info("worker: ожидаю задачи из %s", QUEUE_NAME)
-            channel.start_consuming()
+            _declare_queues(channel)
+            channel.basic_qos(prefetch_count=max_batch)
+
+            pending: list[tuple[str, int, pika.BasicProperties, bytes]] = []
+
+            def on_message(ch, method, properties, body, pending=pending):
+                # дефолтный exchange: routing_key == имя очереди
+                pending.append((method.routing_key, method.delivery_tag, properties, body))
+
+            for queue in handlers:
+                channel.basic_consume(queue=queue, on_message_callback=on_message)
+            logger.info(
+                "worker: ожидаю задачи из %s (batch ≤ %d, wait ≤ %dms)",
+                ", ".join(handlers), max_batch, int(max_wait * 1000),
+            )
+            depth_at = 0.0
+            while True:
+                if time.monotonic() - depth_at >= QUEUE_DEPTH_INTERVAL_SEC:
+                    _measure_depth(channel, handlers)
+                    depth_at = time.monotonic()
+                if not pending:
+                    # не None: в простое глубина очередей тоже обновляется
+                    conn.process_data_events(time_limit=QUEUE_DEPTH_INTERVAL_SEC)
+                    continue
+                deadline = time.monotonic() + max_wait
+                while len(pending) < max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    conn.process_data_events(time_limit=remaining)
+                batch = pending[:max_batch]
+                del pending[:max_batch]
+                by_queue: dict[str, list[tuple[int, pika.BasicProperties, bytes]]] = {}
+                for queue, *message in batch:
+                    by_queue.setdefault(queue, []).append(tuple(message))
+                for queue, messages in by_queue.items():
+                    _handle_batch(channel, queue, messages, handlers[queue])
         except pika.exceptions.AMQPConnectionError as exc:
             logger.warning("AMQP connection lost: %s, retry через %ds", exc, RECONNECT_DELAY_SEC)
             time.sleep(RECONNECT_DELAY_SEC)
         except KeyboardInterrupt:
             logger.info("worker: остановка по KeyboardInterrupt")
             return
+
+
+def _measure_depth(
+    channel: pika.adapters.blocking_connection.BlockingChannel, queues: Iterable[str],
+) -> None:
+    for queue in queues:
+        method = channel.queue_declare(queue=queue, durable=True, passive=True).method
+        QUEUE_DEPTH.labels(queue=queue).set(method.message_count)
+
+
+def _handle_batch(
+    channel: pika.adapters.blocking_connection.BlockingChannel,
+    queue: str,
+    batch: list[tuple[int, pika.BasicProperties, bytes]],
+    handler: Callable[[list[dict]], dict[str, dict] | None],
+) -> None:
+    payloads, tags, props = [], [], []
+    for tag, properties, body in batch:
+        try:
+            payloads.append(json.loads(body))
+            tags.append(tag)
+            props.append(properties)
+        except json.JSONDecodeError:
+            logger.exception("worker: невалидное сообщение %r", body[:200])
+            channel.basic_nack(delivery_tag=tag, requeue=False)
+    if not payloads:
+        return
+    # трейс на каждую задачу: спан ожидания в очереди и общие спаны обработки пачки
+    now = time.time()
+    traces = []
+    for payload, properties in zip(payloads, props, strict=True):
+        trace = tracing.Trace(
+            service="worker",
+            name=queue,
+            trace_id=(properties.headers or {}).get("trace_id") or payload.get("request_id"),
+        )
+        if "published_at" in payload:
+            wait = max(0.0, now - payload["published_at"])
+            QUEUE_WAIT_SECONDS.labels(queue=queue).observe(wait)
+            trace.add("queue", payload["published_at"], wait)
+        traces.append(trace)
+    WORKER_BATCH_SIZE.labels(queue=queue).observe(len(payloads))
+    try:
+        with tracing.activate(*traces), stage(f"handle_{queue}"):
+            replies = handler(payloads) or {}
+    except Exception:
+        logger.exception("worker: ошибка обработки пачки %s", payloads)
+        for tag in tags:
+            channel.basic_nack(delivery_tag=tag, requeue=False)
+        return
+    for payload, properties, trace in zip(payloads, props, traces, strict=True):
+        reply = replies.get(payload.get("request_id"))
+        if reply is not None and properties.reply_to:
+            # спаны воркера едут обратно в ответе — API вливает их в свой трейс
+            reply = {**reply, "trace": {"trace_id": trace.trace_id, "spans": trace.spans}}
+            channel.basic_publish(
+                exchange="",
+                routing_key=properties.reply_to,
+                body=json.dumps(reply, default=str),
+                properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+            )
+        tracing.write(trace)
+    for tag in tags:
+        channel.basic_ack(delivery_tag=tag)
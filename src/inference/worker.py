@@ -1,77 +1,80 @@
 from __future__ import annotations
 
 import argparse
+import json
+import logging
 import pickle
-import re
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
-import torch
 from gensim.models import KeyedVectors
 from sklearn.preprocessing import StandardScaler
 from sqlalchemy import select
 
-from src.common.time_utils import market_is_open, now_msk
+from src.common.memory import format_memory_usage
+from src.common.time_utils import now_msk
+from src.common.tracing import stage
 from src.config import settings
+from src.inference.candles import CandleBuffer
+from src.inference.keys import model_version, news_window, weights_path
+from src.inference.news import (
+    DEFAULT_TOP_N,
+    NerContext,
+    NewsFeatures,
+    build_ner_context,
+    feature_version,
+    from_record,
+    load_kv,
+    process_news_batch,
+)
+from src.inference.news_cache import NewsFeatureCache
 from src.ml.dataset import (
     EMBED_DIM,
     NUMERIC_DIM,
     FitState,
     build_numeric_row,
-    embed_news,
-)
-from src.ml.lstm import NewsLSTM
-from src.preprocessing.features import add_returns, add_time_features
-from src.preprocessing.ner import (
-    build_matcher,
-    extract_for_row,
-    load_tickers,
-    top_tickers,
 )
-from src.preprocessing.text_clean import clean, normalize_title
+from src.ml.lstm_numpy import NumpyNewsLSTM
 from src.storage.db import session_scope
-from src.storage.models import Candle, News
+from src.storage.models import News, NewsFeature
+
+if TYPE_CHECKING:
+    import torch
+
+    from src.ml.lstm import NewsLSTM
 
 DEFAULT_W2V = settings.paths.w2v
 DEFAULT_LSTM = settings.paths.lstm
 DEFAULT_SCALER = settings.paths.scaler
 DEFAULT_TICKERS = settings.paths.tickers
-DEFAULT_TOP_N = 5
 
 HIDDEN_SIZE = 256
 NUM_LAYERS = 1
 DROPOUT = 0.2
-WINDOW_HOURS = 4
 MAX_NEWS_IN_WINDOW = 50
+# torch — fp32 на pick_device; int8 — динамическая квантизация (CPU); numpy — NumpyNewsLSTM.
+# torch импортируется только движками torch/int8: numpy-воркер его не грузит вовсе.
+ENGINES = ("torch", "int8", "numpy")
 
+_candles = CandleBuffer()
 
-def news_window(t: datetime, now: datetime | None = None) -> tuple[datetime, datetime, str]:
-    now = now or now_msk()
-    base_start = t - timedelta(hours=WINDOW_HOURS)
-    if market_is_open(now):
-        return base_start, t, "open"
-    return base_start, now, "closed"
-
-
-@dataclass
-class NerContext:
-    pattern: re.Pattern
-    variant_to_ticker: dict[str, str]
-    weights: dict[str, float]
-    names: dict[str, str]
-    top_set: set[str]
+logger = logging.getLogger("inference.worker")
 
 
 @dataclass
 class InferenceArtifacts:
     kv: KeyedVectors
-    model: NewsLSTM
+    model: NewsLSTM | NumpyNewsLSTM
     scaler: StandardScaler
     ner: NerContext
-    device: torch.device
+    device: torch.device | None
+    news_cache: NewsFeatureCache = field(default_factory=NewsFeatureCache)
+    feature_version: str | None = None
+    model_version: str | None = None
 
 
 @dataclass
@@ -91,6 +94,8 @@ class PredictionResult:
 
 
 def pick_device(arg: str | None) -> torch.device:
+    import torch
+
     if arg:
         if arg == "cuda" and not torch.cuda.is_available():
             raise SystemExit("--device cuda, но cuda недоступна")
@@ -102,6 +107,18 @@ def pick_device(arg: str | None) -> torch.device:
     return torch.device("cpu")
 
 
+def lstm_config(lstm_path: Path) -> dict[str, int | float]:
+    # рядом с весами может лежать <name>.json (distill_lstm пишет его для студента)
+    config: dict[str, int | float] = {
+        "hidden_size": HIDDEN_SIZE, "num_layers": NUM_LAYERS, "dropout": DROPOUT,
+    }
+    meta_path = lstm_path.with_suffix(".json")
+    if meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        config.update({k: meta[k] for k in config if k in meta})
+    return config
+
+
 def load_artifacts(
     w2v_path: Path = DEFAULT_W2V,
     lstm_path: Path = DEFAULT_LSTM,
@@ -109,77 +126,119 @@ def load_artifacts(
     tickers_path: Path = DEFAULT_TICKERS,
     top_n: int = DEFAULT_TOP_N,
     device: str | None = None,
+    mmap: bool | None = None,
+    engine: str | None = None,
 ) -> InferenceArtifacts:
-    dev = pick_device(device)
+    engine = engine or settings.inference_engine
+    if engine not in ENGINES:
+        raise SystemExit(f"Неизвестный INFERENCE_ENGINE={engine!r}: {', '.join(ENGINES)}")
 
-    kv = KeyedVectors.load(str(w2v_path))
+    kv = load_kv(w2v_path, settings.w2v_mmap if mmap is None else mmap)
     if kv.vector_size != EMBED_DIM:
         raise RuntimeError(f"W2V dim={kv.vector_size}, ожидалось {EMBED_DIM}")
 
-    model = NewsLSTM(
-        embed_dim=EMBED_DIM,
-        hidden_size=HIDDEN_SIZE,
-        num_layers=NUM_LAYERS,
-        num_numeric=NUMERIC_DIM,
-        dropout=DROPOUT,
-    )
-    state = torch.load(lstm_path, map_location=dev)
-    model.load_state_dict(state)
-    model.to(dev).eval()
+    dev = None
+    if engine == "numpy":
+        # рядом с .pt может лежать .npz (export_npz) — тогда torch.load не нужен
+        model = NumpyNewsLSTM.load(weights_path(lstm_path, engine))
+    else:
+        import torch
+
+        from src.ml.lstm import NewsLSTM, quantize_dynamic_int8
+
+        dev = pick_device(device) if engine == "torch" else torch.device("cpu")
+        config = lstm_config(lstm_path)
+        model = NewsLSTM(
+            embed_dim=EMBED_DIM,
+            hidden_size=int(config["hidden_size"]),
+            num_layers=int(config["num_layers"]),
+            num_numeric=NUMERIC_DIM,
+            dropout=float(config["dropout"]),
+        )
+        state = torch.load(lstm_path, map_location=dev)
+        model.load_state_dict(state)
+        model.to(dev).eval()
+        if engine == "int8":
+            model = quantize_dynamic_int8(model)
 
     with scaler_path.open("rb") as f:
         fit_state: FitState = pickle.load(f)
 
-    tickers = load_tickers(tickers_path)
-    pattern, variant_to_ticker = build_matcher(tickers)
-    weights = {t: float(info.get("weight", 0.0)) for t, info in tickers.items()}
-    names = {t: info.get("name", t) for t, info in tickers.items()}
-    ner = NerContext(
-        pattern=pattern,
-        variant_to_ticker=variant_to_ticker,
-        weights=weights,
-        names=names,
-        top_set=top_tickers(tickers, top_n),
-    )
-
+    logger.info("artifacts: память процесса %s", format_memory_usage())
+    features = feature_version(w2v_path, tickers_path, top_n)
     return InferenceArtifacts(
         kv=kv,
         model=model,
         scaler=fit_state.numeric_scaler,
-        ner=ner,
+        ner=build_ner_context(tickers_path, top_n),
         device=dev,
+        news_cache=NewsFeatureCache(),
+        feature_version=features,
+        model_version=model_version(features, lstm_path, scaler_path, engine),
     )
 
 
-def fetch_candles(until: datetime) -> pd.DataFrame:
-    with session_scope() as s:
-        rows = s.execute(
-            select(Candle.dt, Candle.open, Candle.close)
-            .where(Candle.dt <= until)
-            .order_by(Candle.dt)
-        ).all()
-    return pd.DataFrame(rows, columns=["dt", "open", "close"])
+NEWS_COLUMNS = ["source", "source_id", "ts", "title", "body"]
+FEATURE_COLUMNS = [
+    "cleaned", "display", "tickers", "org_weight", "n_components", "has_top",
+    "token_ids", "embedding",
+]
 
 
-def fetch_news(start: datetime, end: datetime) -> pd.DataFrame:
-    with session_scope() as s:
+def fetch_news(start: datetime, end: datetime, version: str | None = None) -> pd.DataFrame:
+    # С version подтягиваем готовые признаки из news_features (их пишет ingest),
+    # одним запросом по ix_news_ts; для новостей без признаков колонки = NULL.
+    cols = [News.source, News.source_id, News.ts, News.title, News.body]
+    columns = list(NEWS_COLUMNS)
+    stmt = select(*cols)
+    if version is not None:
+        stmt = select(*cols, *(getattr(NewsFeature, c) for c in FEATURE_COLUMNS)).outerjoin(
+            NewsFeature,
+            (NewsFeature.news_id == News.id) & (NewsFeature.version == version),
+        )
+        columns += FEATURE_COLUMNS
+    with stage("fetch_news"), session_scope() as s:
         rows = s.execute(
-            select(News.source, News.source_id, News.ts, News.title, News.body)
-            .where(News.ts >= start, News.ts < end)
-            .order_by(News.ts)
+            stmt.where(News.ts >= start, News.ts < end).order_by(News.ts, News.id)
         ).all()
-    return pd.DataFrame(rows, columns=["source", "source_id", "ts", "title", "body"])
-
-
-def _clean_news_texts(news: pd.DataFrame) -> list[str]:
-    titles = news["title"].fillna("").map(normalize_title)
-    bodies = news["body"].fillna("")
-    cleaned = (titles + " " + bodies).map(clean)
-    return [t for t in cleaned.tolist() if t]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def news_features(artifacts: InferenceArtifacts, news: pd.DataFrame) -> list[NewsFeatures]:
+    return [feats for feats in _resolve_features(artifacts, news) if feats.cleaned]
+
+
+def _resolve_features(artifacts: InferenceArtifacts, news: pd.DataFrame) -> list[NewsFeatures]:
+    # признаки по строкам news, в том же порядке (пустые cleaned не отфильтрованы)
+    cache = artifacts.news_cache
+    stored = "embedding" in news.columns
+    records = news.to_dict("records")
+    resolved: list[NewsFeatures | None] = []
+    for rec in records:
+        key = (rec["source"], rec["source_id"])
+        feats = cache.get(key)
+        if feats is None and stored and rec["embedding"] is not None:
+            feats = from_record(rec)
+            cache.put(key, feats)
+        resolved.append(feats)
+
+    # необогащённые новости прогоняем через текстовый пайплайн одним батчем
+    missing = [i for i, feats in enumerate(resolved) if feats is None]
+    if missing:
+        processed = process_news_batch(
+            [records[i]["title"] for i in missing],
+            [records[i]["body"] for i in missing],
+            artifacts.kv,
+            artifacts.ner,
+        )
+        for i, feats in zip(missing, processed, strict=True):
+            cache.put((records[i]["source"], records[i]["source_id"]), feats)
+            resolved[i] = feats
+    return resolved
 
 
-def _ner_aggregates(cleaned_texts: list[str], ner: NerContext) -> dict[str, float | int | bool]:
-    if not cleaned_texts:
+def _ner_aggregates(items: list[NewsFeatures]) -> dict[str, float | int | bool]:
+    if not items:
         return {
             "n_news": 0,
             "ner_org_weight_sum_mean": 0.0,
@@ -187,100 +246,225 @@ def _ner_aggregates(cleaned_texts: list[str], ner: NerContext) -> dict[str, floa
             "ner_n_index_components_sum": 0,
             "ner_has_top_company_any": False,
         }
-    weights, counts, has_top = [], [], False
-    for text in cleaned_texts:
-        _, w, n, top = extract_for_row(
-            text, ner.pattern, ner.variant_to_ticker, ner.weights, ner.top_set
-        )
-        weights.append(w)
-        counts.append(n)
-        has_top = has_top or top
-    weights_arr = np.array(weights, dtype=np.float64)
+    weights_arr = np.array([it.org_weight for it in items], dtype=np.float64)
     return {
-        "n_news": len(cleaned_texts),
+        "n_news": len(items),
         "ner_org_weight_sum_mean": float(weights_arr.mean()),
         "ner_org_weight_sum_max": float(weights_arr.max()),
-        "ner_n_index_components_sum": int(sum(counts)),
-        "ner_has_top_company_any": bool(has_top),
+        "ner_n_index_components_sum": int(sum(it.n_components for it in items)),
+        "ner_has_top_company_any": any(it.has_top for it in items),
     }
 
 
-def _candle_row_at(candles: pd.DataFrame, t: datetime) -> pd.Series:
-    enriched = add_time_features(add_returns(candles.copy()))
-    mask = enriched["dt"] == pd.Timestamp(t)
-    if not mask.any():
-        raise SystemExit(
-            f"Нет свечи на момент {t} в БД (последняя: {enriched['dt'].max()})"
-        )
-    row = enriched.loc[mask].iloc[0]
-    for col in ("ret_1", "ret_60", "ret_120"):
-        if pd.isna(row[col]):
-            raise SystemExit(f"Нет валидного {col} на {t} (мало истории)")
-    return row
+def candle_row_at(t: datetime) -> pd.Series:
+    with stage("candles"):
+        return _candles.row_at(t)
 
 
-def predict_at(
+@dataclass
+class PreparedInput:
+    t: datetime
+    candle_row: pd.Series
+    items: list[NewsFeatures]
+    n_total: int
+    ner_agg: dict[str, float | int | bool]
+    numeric_scaled: np.ndarray
+    market_status: str
+    window_start: datetime
+    window_end: datetime
+
+    @property
+    def news_vecs(self) -> np.ndarray:
+        if not self.items:
+            return np.zeros((0, EMBED_DIM), dtype=np.float32)
+        return np.stack([it.embedding for it in self.items])
+
+
+def prepare_input(
     artifacts: InferenceArtifacts,
     t: datetime,
     now: datetime | None = None,
-) -> PredictionResult:
-    candles = fetch_candles(until=t)
-    candle_row = _candle_row_at(candles, t)
+) -> PreparedInput:
+    candle_row = candle_row_at(t)
 
     window_start, window_end, status = news_window(t, now)
-    news = fetch_news(window_start, window_end)
-    cleaned_texts = _clean_news_texts(news)
-    n_total = len(cleaned_texts)
+    news = fetch_news(window_start, window_end, artifacts.feature_version)
+    items = news_features(artifacts, news)
+    return _assemble_input(
+        artifacts, t, candle_row, items, status, window_start, window_end,
+    )
+
+
+def prepare_inputs(
+    artifacts: InferenceArtifacts,
+    dts: list[datetime],
+    now: datetime | None = None,
+    rows: dict[datetime, pd.Series | SystemExit] | None = None,
+    historical: bool = False,
+) -> tuple[list[PreparedInput], dict[datetime, str]]:
+    # Пачка dt: одно обновление свечей, один fetch_news на объединение окон,
+    # признаки каждой новости — один раз; окна dt режутся из общего списка по ts.
+    # rows — уже готовые строки свечей (backfill); historical — окно «как в момент dt»
+    # (now = dt), а не продлённое до текущего времени при закрытом рынке.
+    # Возвращает входы для успешных dt и ошибки по остальным.
+    now = now or now_msk()
+    if rows is None:
+        with stage("candles"):
+            rows = _candles.rows_at(dts)
+    errors = {t: str(row) for t, row in rows.items() if isinstance(row, SystemExit)}
+    windows = {
+        t: news_window(t, t if historical else now) for t in dts if t not in errors
+    }
+    if not windows:
+        return [], errors
+
+    inputs = []
+    for cluster in _overlapping(windows):
+        union_start = min(windows[t][0] for t in cluster)
+        union_end = max(windows[t][1] for t in cluster)
+        news = fetch_news(union_start, union_end, artifacts.feature_version)
+        feats = _resolve_features(artifacts, news)
+        ts = news["ts"].to_numpy(dtype="datetime64[ns]")
+        for t in cluster:
+            window_start, window_end, status = windows[t]
+            mask = (ts >= np.datetime64(window_start)) & (ts < np.datetime64(window_end))
+            items = [feats[i] for i in np.flatnonzero(mask) if feats[i].cleaned]
+            inputs.append(_assemble_input(
+                artifacts, t, rows[t], items, status, window_start, window_end,
+            ))
+    return inputs, errors
+
+
+def _overlapping(windows: dict[datetime, tuple[datetime, datetime, str]]) -> list[list[datetime]]:
+    # далёкие друг от друга dt (например, /predict?dt=<год назад> в одной пачке
+    # с последним) не склеиваем в одно огромное окно — группы пересекающихся окон
+    clusters: list[list[datetime]] = []
+    cluster_end: datetime | None = None
+    for t in sorted(windows, key=lambda t: windows[t][0]):
+        start, end, _ = windows[t]
+        if cluster_end is None or start > cluster_end:
+            clusters.append([])
+            cluster_end = end
+        clusters[-1].append(t)
+        cluster_end = max(cluster_end, end)
+    return clusters
+
+
+def _assemble_input(
+    artifacts: InferenceArtifacts,
+    t: datetime,
+    candle_row: pd.Series,
+    items: list[NewsFeatures],
+    status: str,
+    window_start: datetime,
+    window_end: datetime,
+) -> PreparedInput:
+    n_total = len(items)
     if n_total > MAX_NEWS_IN_WINDOW:
-        cleaned_texts = cleaned_texts[-MAX_NEWS_IN_WINDOW:]
-    ner_agg = _ner_aggregates(cleaned_texts, artifacts.ner)
+        items = items[-MAX_NEWS_IN_WINDOW:]
+    with stage("ner_aggregates"):
+        ner_agg = _ner_aggregates(items)
+
+    with stage("numeric"):
+        feature_row = pd.Series({**candle_row.to_dict(), **ner_agg})
+        numeric_raw = build_numeric_row(feature_row).reshape(1, -1)
+        numeric_scaled = artifacts.scaler.transform(numeric_raw).astype(np.float32)
+
+    return PreparedInput(
+        t=t,
+        candle_row=candle_row,
+        items=items,
+        n_total=n_total,
+        ner_agg=ner_agg,
+        numeric_scaled=numeric_scaled,
+        market_status=status,
+        window_start=window_start,
+        window_end=window_end,
+    )
 
-    feature_row = pd.Series({**candle_row.to_dict(), **ner_agg})
-    numeric_raw = build_numeric_row(feature_row).reshape(1, -1)
-    numeric_scaled = artifacts.scaler.transform(numeric_raw).astype(np.float32)
 
-    if cleaned_texts:
-        news_vecs = np.stack([embed_news(text, artifacts.kv) for text in cleaned_texts])
-    else:
-        news_vecs = np.zeros((0, EMBED_DIM), dtype=np.float32)
+def forward_batch(
+    artifacts: InferenceArtifacts,
+    seqs: list[np.ndarray],
+    numeric_scaled: np.ndarray,
+) -> np.ndarray:
+    with stage("forward"):
+        return _forward_batch(artifacts, seqs, numeric_scaled)
 
-    n_news = news_vecs.shape[0]
-    max_len = max(1, n_news)
-    text_emb = torch.zeros(1, max_len, EMBED_DIM, dtype=torch.float32)
-    if n_news:
-        text_emb[0, :n_news] = torch.from_numpy(news_vecs)
-    lengths = torch.tensor([n_news], dtype=torch.long)
-    numeric = torch.from_numpy(numeric_scaled)
+
+def _forward_batch(
+    artifacts: InferenceArtifacts,
+    seqs: list[np.ndarray],
+    numeric_scaled: np.ndarray,
+) -> np.ndarray:
+    # seqs[b] — (n_b, EMBED_DIM), numeric_scaled — (B, NUMERIC_DIM); паддинг до max n_b
+    B = len(seqs)
+    max_len = max([1, *(seq.shape[0] for seq in seqs)])
+    if isinstance(artifacts.model, NumpyNewsLSTM):
+        text_np = np.zeros((B, max_len, EMBED_DIM), dtype=np.float32)
+        for b, seq in enumerate(seqs):
+            text_np[b, :seq.shape[0]] = seq
+        lengths_np = np.array([seq.shape[0] for seq in seqs], dtype=np.int64)
+        return artifacts.model(text_np, lengths_np, numeric_scaled)
+
+    import torch
+
+    text_emb = torch.zeros(B, max_len, EMBED_DIM, dtype=torch.float32)
+    lengths = torch.zeros(B, dtype=torch.long)
+    for b, seq in enumerate(seqs):
+        n = seq.shape[0]
+        lengths[b] = n
+        if n:
+            text_emb[b, :n] = torch.from_numpy(seq)
+    numeric = torch.from_numpy(np.ascontiguousarray(numeric_scaled, dtype=np.float32))
 
     with torch.no_grad():
-        text_emb_d = text_emb.to(artifacts.device)
-        numeric_d = numeric.to(artifacts.device)
-        y_pred = artifacts.model(text_emb_d, lengths, numeric_d).cpu().item()
+        text_emb = text_emb.to(artifacts.device)
+        numeric = numeric.to(artifacts.device)
+        return artifacts.model(text_emb, lengths, numeric).cpu().numpy()
+
 
+def to_result(inp: PreparedInput, y_pred: float) -> PredictionResult:
     return PredictionResult(
-        dt=t,
+        dt=inp.t,
         y_pred=float(y_pred),
-        n_news=ner_agg["n_news"],
-        n_news_window_total=n_total,
-        ret_1=float(candle_row["ret_1"]),
-        ret_60=float(candle_row["ret_60"]),
-        ret_120=float(candle_row["ret_120"]),
-        ner_org_weight_sum_mean=ner_agg["ner_org_weight_sum_mean"],
-        ner_has_top_company_any=ner_agg["ner_has_top_company_any"],
-        market_status=status,
-        window_start=window_start,
-        window_end=window_end,
+        n_news=inp.ner_agg["n_news"],
+        n_news_window_total=inp.n_total,
+        ret_1=float(inp.candle_row["ret_1"]),
+        ret_60=float(inp.candle_row["ret_60"]),
+        ret_120=float(inp.candle_row["ret_120"]),
+        ner_org_weight_sum_mean=inp.ner_agg["ner_org_weight_sum_mean"],
+        ner_has_top_company_any=inp.ner_agg["ner_has_top_company_any"],
+        market_status=inp.market_status,
+        window_start=inp.window_start,
+        window_end=inp.window_end,
+    )
+
+
+def predict_batch(
+    artifacts: InferenceArtifacts,
+    inputs: list[PreparedInput],
+) -> list[PredictionResult]:
+    if not inputs:
+        return []
+    y = forward_batch(
+        artifacts,
+        [inp.news_vecs for inp in inputs],
+        np.concatenate([inp.numeric_scaled for inp in inputs]),
     )
+    return [to_result(inp, y_b) for inp, y_b in zip(inputs, y, strict=True)]
+
+
+def predict_at(
+    artifacts: InferenceArtifacts,
+    t: datetime,
+    now: datetime | None = None,
+) -> PredictionResult:
+    return predict_batch(artifacts, [prepare_input(artifacts, t, now)])[0]
 
 
 def _latest_valid_dts(k: int = 1) -> list[datetime]:
-    candles = fetch_candles(until=now_msk())
-    enriched = add_returns(candles.copy())
-    eligible = enriched[enriched[["ret_1", "ret_60", "ret_120"]].notna().all(axis=1)]
-    if eligible.empty:
-        raise SystemExit("Нет свечей с валидным lookback (мало истории)")
-    tail = eligible["dt"].sort_values(ascending=False).head(k)
-    return [ts.to_pydatetime() for ts in tail]
+    return _candles.latest_valid_dts(k, until=now_msk())
 
 
 def _latest_valid_dt() -> datetime:
@@ -296,6 +480,7 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--scaler", type=Path, default=DEFAULT_SCALER)
     p.add_argument("--tickers", type=Path, default=DEFAULT_TICKERS)
     p.add_argument("--device", default=None)
+    p.add_argument("--engine", choices=ENGINES, default=None)
     return p.parse_args()
 
 
@@ -315,6 +500,7 @@ def main() -> None:
         scaler_path=args.scaler,
         tickers_path=args.tickers,
         device=args.device,
+        engine=args.engine,
     )
     result = predict_at(artifacts, t)
 
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+
+from src.common.time_utils import now_msk
+from src.config import settings
+from src.inference.cache import PredictionCache
+from src.inference.candles import CandleBuffer
+from src.inference.keys import (
+    explain_cache_key,
+    format_cache_key,
+    news_window,
+    window_fingerprints,
+)
+from src.inference.queue import publish_explain_task, publish_predict_task
+from src.storage.db import recent_prediction_payloads, session_scope
+
+# /history отдаёт не больше 50 точек — столько и прогреваем
+WARM_LIMIT = 50
+
+logger = logging.getLogger("ingest.ahead")
+
+
+class PredictAhead:
+    # После каждой загрузки свечей: если появился новый последний валидный dt,
+    # ставим его прогноз (и, по настройке, explain) в очередь, не дожидаясь /predict.
+    def __init__(self, cache: PredictionCache, explain: bool | None = None) -> None:
+        self._cache = cache
+        self._explain = settings.predict_ahead_explain if explain is None else explain
+        self._candles = CandleBuffer()
+        self._last: datetime | None = None
+
+    def _latest_valid_dt(self) -> datetime | None:
+        try:
+            return self._candles.latest_valid_dts(1, until=now_msk())[0]
+        except SystemExit as exc:
+            logger.warning("ahead: нет валидного dt: %s", exc)
+            return None
+
+    def check(self) -> None:
+        # новый dt публикуем один раз, воркер сам кладёт результат в Redis и predictions
+        dt = self._latest_valid_dt()
+        if dt is None or dt == self._last:
+            return
+        dt_iso = dt.isoformat()
+        request_id = publish_predict_task(dt_iso)
+        logger.info("ahead: новый dt=%s → predict req=%s", dt_iso, request_id)
+        if self._explain and not self._explain_cached(dt):
+            publish_explain_task(dt_iso)
+        self._last = dt
+
+    def _explain_cached(self, dt: datetime) -> bool:
+        # leave-one-out дорогой: не ставим explain, если он уже лежит под текущим ключом.
+        # Версию модели публикует predict-worker; пока её нет — считаем, что не в кэше
+        version = self._cache.model_version()
+        if version is None:
+            return False
+        key = self._cache.explain_key(explain_cache_key(dt, version))
+        return self._cache.get_raw(key, settings.explain_cache_ttl_sec) is not None
+
+    def warm(self) -> int:
+        # Прогрев Redis из таблицы predictions. Ключ — отпечаток текущего окна dt;
+        # строку кладём, только если он совпал с отпечатком окна, на котором она
+        # посчитана, — т.е. с тех пор в окно не пришло новостей.
+        with session_scope() as s:
+            payloads = [
+                p for p in recent_prediction_payloads(s, WARM_LIMIT) if p["model_version"]
+            ]
+        now = now_msk()
+        dts = [datetime.fromisoformat(p["dt"]) for p in payloads]
+        current = [news_window(t, now)[:2] for t in dts]
+        stored = [
+            (datetime.fromisoformat(p["window_start"]), datetime.fromisoformat(p["window_end"]))
+            for p in payloads
+        ]
+        fingerprints = window_fingerprints(current + stored)
+        warmed = 0
+        for i, (t, payload) in enumerate(zip(dts, payloads, strict=True)):
+            fingerprint = fingerprints[i]
+            if fingerprint != fingerprints[len(dts) + i]:
+                continue
+            self._cache.set(format_cache_key(t, payload["model_version"], fingerprint), payload)
+            warmed += 1
+        logger.info("ahead: прогрето из predictions: %d из %d", warmed, len(payloads))
+        return warmed
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import argparse
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from gensim.models import KeyedVectors
+
+from src.common.memory import format_memory_usage
+from src.common.time_utils import now_msk
+from src.config import settings
+from src.inference.news import (
+    DEFAULT_TOP_N,
+    NerContext,
+    build_ner_context,
+    feature_version,
+    load_kv,
+    process_news_batch,
+    to_record,
+)
+from src.storage.db import (
+    init_schema,
+    news_missing_features,
+    save_news_features,
+    session_scope,
+)
+
+DEFAULT_W2V = settings.paths.w2v
+DEFAULT_TICKERS = settings.paths.tickers
+# Старше недели live-запросы новости не видят; исторический корпус — через --days.
+DEFAULT_LOOKBACK_DAYS = 7
+BATCH_SIZE = 500
+
+logger = logging.getLogger("ingest.enrich")
+
+
+@dataclass
+class NewsEnricher:
+    kv: KeyedVectors
+    ner: NerContext
+    version: str
+
+
+def load_enricher(
+    w2v_path: Path = DEFAULT_W2V,
+    tickers_path: Path = DEFAULT_TICKERS,
+    top_n: int = DEFAULT_TOP_N,
+) -> NewsEnricher | None:
+    if not w2v_path.exists():
+        logger.warning("enrich: нет %s — обогащение новостей отключено", w2v_path)
+        return None
+    kv = load_kv(w2v_path, settings.w2v_mmap)
+    version = feature_version(w2v_path, tickers_path, top_n)
+    logger.info(
+        "enrich: W2V %s, версия признаков %s, память %s",
+        w2v_path, version, format_memory_usage(),
+    )
+    return NewsEnricher(kv=kv, ner=build_ner_context(tickers_path, top_n), version=version)
+
+
+def enrich_pending(enricher: NewsEnricher, since: datetime | None = None) -> int:
+    since = since or now_msk() - timedelta(days=DEFAULT_LOOKBACK_DAYS)
+    total = 0
+    while True:
+        with session_scope() as s:
+            pending = news_missing_features(s, enricher.version, since, BATCH_SIZE)
+            processed = process_news_batch(
+                [item["title"] for item in pending],
+                [item["body"] for item in pending],
+                enricher.kv,
+                enricher.ner,
+            )
+            rows = [
+                {
+                    "news_id": item["id"],
+                    "version": enricher.version,
+                    "ts": item["ts"],
+                    **to_record(feats),
+                }
+                for item, feats in zip(pending, processed, strict=True)
+            ]
+            save_news_features(s, rows)
+        total += len(pending)
+        if len(pending) < BATCH_SIZE:
+            return total
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Признаки новостей (clean + NER + W2V) → news_features")
+    p.add_argument("--w2v", type=Path, default=DEFAULT_W2V)
+    p.add_argument("--tickers", type=Path, default=DEFAULT_TICKERS)
+    p.add_argument("--days", type=int, default=DEFAULT_LOOKBACK_DAYS)
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+    init_schema()
+    enricher = load_enricher(args.w2v, args.tickers)
+    if enricher is None:
+        raise SystemExit(f"Нет W2V-артефакта: {args.w2v}")
+    n = enrich_pending(enricher, since=now_msk() - timedelta(days=args.days))
+    print(f"Обогащено новостей: {n} (версия {enricher.version})")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ import yaml
 
 from src.common.time_utils import MSK
 from src.config import settings
+from src.ingest.enrich import NewsEnricher, enrich_pending, load_enricher
 from src.preprocessing.text_clean import strip_html
 from src.storage.db import init_schema, insert_news, session_scope
 
@@ -84,7 +85,10 @@ def fetch_feed(url: str, source_tag: str) -> list[dict]:
     return rows
 
 
-def run_once(sources_path: Path = DEFAULT_SOURCES) -> dict[str, int]:
+def run_once(
+    sources_path: Path = DEFAULT_SOURCES,
+    enricher: NewsEnricher | None = None,
+) -> dict[str, int]:
     feeds = load_feeds(sources_path)
     if not feeds:
         print("Нет RSS-источников в", sources_path)
@@ -106,19 +110,28 @@ def run_once(sources_path: Path = DEFAULT_SOURCES) -> dict[str, int]:
         summary[tag] = inserted
         print(f"  [{tag:10s}] получено {len(rows):4d}, вставлено {inserted:4d}")
 
+    if enricher is not None:
+        try:
+            enriched = enrich_pending(enricher)
+            print(f"  [enrich    ] признаки посчитаны для {enriched:4d} новостей")
+        except Exception as exc:
+            print(f"  [enrich    ] FAIL: {exc!r}")
+
     return summary
 
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Опрос RSS-лент → Postgres")
     p.add_argument("--sources", type=Path, default=DEFAULT_SOURCES)
+    p.add_argument("--no-enrich", action="store_true", help="не считать news_features")
     return p.parse_args()
 
 
 def main() -> None:
     args = parse_args()
     print(f"Источники: {args.sources}\n")
-    summary = run_once(args.sources)
+    enricher = None if args.no_enrich else load_enricher()
+    summary = run_once(args.sources, enricher)
     total = sum(v for v in summary.values() if v >= 0)
     print(f"\nИтого вставлено: {total}")
 
@@ -7,6 +7,10 @@ from pathlib import Path
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from src.config import settings
+from src.inference.cache import PredictionCache
+from src.inference.queue import close_publisher
+from src.ingest.ahead import PredictAhead
+from src.ingest.enrich import NewsEnricher, load_enricher
 from src.ingest.iss import download as iss_download
 from src.ingest.iss import live_range as iss_live_range
 from src.ingest.rss import run_once as rss_run_once
@@ -15,16 +19,16 @@ from src.storage.db import init_schema
 logger = logging.getLogger("ingest.scheduler")
 
 
-def job_rss(sources: Path) -> None:
+def job_rss(sources: Path, enricher: NewsEnricher | None = None) -> None:
     try:
-        summary = rss_run_once(sources)
+        summary = rss_run_once(sources, enricher)
         total = sum(v for v in summary.values() if v >= 0)
         logger.info("rss: вставлено %d (по источникам: %s)", total, summary)
     except Exception:
         logger.exception("rss: упало")
 
 
-def job_iss() -> None:
+def job_iss(ahead: PredictAhead | None = None) -> None:
     try:
         date_from, date_till = iss_live_range()
         iss_download(
@@ -35,6 +39,13 @@ def job_iss() -> None:
         )
     except Exception:
         logger.exception("iss: упало")
+        return
+    if ahead is None:
+        return
+    try:
+        ahead.check()
+    except Exception:
+        logger.exception("ahead: упало")
 
 
 def parse_args() -> argparse.Namespace:
@@ -42,6 +53,11 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--sources", type=Path, default=settings.paths.sources)
     p.add_argument("--rss-interval-min", type=int, default=settings.schedules.rss_interval_min)
     p.add_argument("--iss-interval-min", type=int, default=settings.schedules.iss_interval_min)
+    p.add_argument("--no-enrich", action="store_true", help="не считать news_features после RSS")
+    p.add_argument(
+        "--no-predict-ahead", action="store_true",
+        help="не ставить прогноз нового dt в очередь после ISS и не прогревать Redis",
+    )
     return p.parse_args()
 
 
@@ -52,6 +68,14 @@ def main() -> None:
         format="%(asctime)s %(name)s %(levelname)s %(message)s",
     )
     init_schema()
+    enricher = None if args.no_enrich else load_enricher()
+    ahead = None
+    if not args.no_predict_ahead:
+        ahead = PredictAhead(PredictionCache())
+        try:
+            ahead.warm()
+        except Exception:
+            logger.exception("ahead: прогрев упал")
     logger.info(
         "Старт: RSS каждые %d мин, ISS каждые %d мин",
         args.rss_interval_min,
@@ -59,15 +83,15 @@ def main() -> None:
     )
 
     logger.info("Initial run: RSS + ISS")
-    job_rss(args.sources)
-    job_iss()
+    job_rss(args.sources, enricher)
+    job_iss(ahead)
 
     scheduler = BlockingScheduler(timezone="Europe/Moscow")
     scheduler.add_job(
         job_rss,
         "interval",
         minutes=args.rss_interval_min,
-        args=(args.sources,),
+        args=(args.sources, enricher),
         id="rss_poll",
         max_instances=1,
         coalesce=True,
@@ -76,6 +100,7 @@ def main() -> None:
         job_iss,
         "interval",
         minutes=args.iss_interval_min,
+        args=(ahead,),
         id="iss_poll",
         max_instances=1,
         coalesce=True,
@@ -84,6 +109,8 @@ def main() -> None:
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
         logger.info("Остановка")
+    finally:
+        close_publisher()
 
 
 if __name__ == "__main__":
@@ -1,16 +1,15 @@
 from __future__ import annotations
 
 import math
+from collections.abc import Iterable, Sequence
 from dataclasses import dataclass
+from itertools import chain, repeat
 from pathlib import Path
-from typing import Iterable
 
 import numpy as np
 import pandas as pd
-import torch
 from gensim.models import KeyedVectors
 from sklearn.preprocessing import StandardScaler
-from torch.utils.data import Dataset
 
 RAW_NUMERIC_COLS = [
     "ret_1", "ret_60", "ret_120",
@@ -49,18 +48,78 @@ NUMERIC_DIM = 11
 
 
 def embed_news(text: str, kv: KeyedVectors, dim: int = EMBED_DIM) -> np.ndarray:
-    vecs = [kv[tok] for tok in text.split() if tok in kv]
+    vecs = [np.asarray(kv[tok], dtype=np.float32) for tok in text.split() if tok in kv]
     if not vecs:
         return np.zeros(dim, dtype=np.float32)
     return np.mean(vecs, axis=0).astype(np.float32)
 
 
+def tokenize_batch(texts: Sequence[str], kv: KeyedVectors) -> tuple[np.ndarray, np.ndarray]:
+    # Все документы → один плоский массив id токенов (только из словаря) + offsets:
+    # токены документа i лежат в ids[offsets[i]:offsets[i + 1]].
+    split = [text.split() for text in texts]
+    lengths = np.fromiter(map(len, split), dtype=np.int64, count=len(split))
+    raw = np.fromiter(
+        map(kv.key_to_index.get, chain.from_iterable(split), repeat(-1)),
+        dtype=np.int64,
+        count=int(lengths.sum()),
+    )
+    known = raw >= 0
+    doc_of_token = np.repeat(np.arange(len(split)), lengths)
+    counts = np.bincount(doc_of_token[known], minlength=len(split))
+    offsets = np.zeros(len(split) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return raw[known], offsets
+
+
+def embed_token_ids(
+    ids: np.ndarray,
+    offsets: np.ndarray,
+    vectors: np.ndarray,
+    dim: int = EMBED_DIM,
+) -> np.ndarray:
+    # Должно побитово совпадать с embed_news. np.mean(axis=0) складывает строки
+    # последовательно (np.add.reduceat — попарно, и расходится в последнем бите),
+    # поэтому после одного gather накапливаем по позиции токена: на шаге k —
+    # k-й токен всех документов длиннее k (документы отсортированы по длине).
+    n_docs = len(offsets) - 1
+    out = np.zeros((n_docs, dim), dtype=np.float32)
+    counts = np.diff(offsets)
+    if n_docs == 0 or counts.max() == 0:
+        return out
+    # компактный словарь хранит float16 — поднимаем после gather (float32 без копии)
+    gathered = vectors[ids].astype(np.float32, copy=False)
+    order = np.argsort(-counts, kind="stable")
+    starts = offsets[:-1][order]
+    sorted_counts = counts[order]
+    n_active = int(np.count_nonzero(sorted_counts))
+    # сколько документов длиннее k, для каждого k — по убыванию длины это префикс
+    steps = np.arange(1, int(sorted_counts[0]))
+    active = n_docs - np.searchsorted(sorted_counts[::-1], steps, side="right")
+    sums = gathered[starts[:n_active]]
+    for k, m in zip(steps, active, strict=True):
+        sums[:m] += gathered[starts[:m] + k]
+    # np.mean делит float32-сумму на intp, т.е. в float64, и только потом кастует
+    means = sums / sorted_counts[:n_active].astype(np.float64)[:, None]
+    out[order[:n_active]] = means.astype(np.float32)
+    return out
+
+
+def embed_batch(texts: Sequence[str], kv: KeyedVectors, dim: int = EMBED_DIM) -> np.ndarray:
+    ids, offsets = tokenize_batch(texts, kv)
+    return embed_token_ids(ids, offsets, kv.vectors, dim)
+
+
+# Модуль импортируется без torch: FitState лежит в lstm_scaler.pkl, и его распаковка
+# не должна тянуть torch в numpy-воркер. DataLoader'у достаточно __len__/__getitem__.
+
+
 @dataclass
 class FitState:
     numeric_scaler: StandardScaler
 
 
-class NewsLSTMDataset(Dataset):
+class NewsLSTMDataset:
     def __init__(
         self,
         parquet_path: Path,
@@ -70,13 +129,15 @@ class NewsLSTMDataset(Dataset):
         df = pd.read_parquet(parquet_path)
         df = df.sort_values("dt").reset_index(drop=True)
 
-        self.text_embs: list[np.ndarray] = []
-        for seq in df["text_sequence"]:
-            if not isinstance(seq, (list, np.ndarray)) or len(seq) == 0:
-                self.text_embs.append(np.zeros((0, EMBED_DIM), dtype=np.float32))
-                continue
-            news_vecs = np.stack([embed_news(t, kv) for t in seq])
-            self.text_embs.append(news_vecs)
+        seqs = [
+            list(seq) if isinstance(seq, (list, np.ndarray)) else []
+            for seq in df["text_sequence"]
+        ]
+        all_vecs = embed_batch([t for seq in seqs for t in seq], kv)
+        bounds = np.cumsum([0, *(len(seq) for seq in seqs)])
+        self.text_embs: list[np.ndarray] = [
+            all_vecs[bounds[i]:bounds[i + 1]] for i in range(len(seqs))
+        ]
 
         numeric_raw = np.stack([build_numeric_row(r) for _, r in df.iterrows()])
 
@@ -98,6 +159,8 @@ class NewsLSTMDataset(Dataset):
 
 
 def collate(batch: Iterable[tuple[np.ndarray, np.ndarray, float]]):
+    import torch
+
     text_embs, numerics, targets = zip(*batch)
     B = len(batch)
     lengths = torch.tensor([t.shape[0] for t in text_embs], dtype=torch.long)
@@ -0,0 +1,200 @@
+import argparse
+import json
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from gensim.models import KeyedVectors
+from torch.utils.data import DataLoader, Dataset
+
+from src.ml.dataset import EMBED_DIM, NUMERIC_DIM, NewsLSTMDataset, collate
+from src.ml.eval import evaluate, format_metrics
+from src.ml.lstm import NewsLSTM
+from src.ml.train_lstm import pick_device, predict
+
+DEFAULT_TRAIN = Path("data/processed/train.parquet")
+DEFAULT_VAL = Path("data/processed/val.parquet")
+DEFAULT_TEST = Path("data/processed/test.parquet")
+DEFAULT_W2V = Path("models/word2vec.kv")
+DEFAULT_TEACHER = Path("models/lstm_best.pt")
+DEFAULT_SCALER = Path("models/lstm_scaler.pkl")
+DEFAULT_OUT = Path("models/lstm_student.pt")
+
+
+class DistillDataset(Dataset):
+    # окна обучающего сплита + выход учителя на них (посчитан один раз)
+    def __init__(self, base: NewsLSTMDataset, teacher_preds: np.ndarray) -> None:
+        self.base = base
+        self.teacher_preds = teacher_preds.astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def __getitem__(self, idx: int):
+        text, numeric, target = self.base[idx]
+        return text, numeric, target, self.teacher_preds[idx]
+
+
+def collate_distill(batch):
+    batch = list(batch)
+    padded, lengths, numeric, target = collate([b[:3] for b in batch])
+    teacher = torch.tensor([b[3] for b in batch], dtype=torch.float32)
+    return padded, lengths, numeric, target, teacher
+
+
+def load_model(path: Path, hidden_size: int, device: torch.device) -> NewsLSTM:
+    model = NewsLSTM(embed_dim=EMBED_DIM, hidden_size=hidden_size, num_numeric=NUMERIC_DIM)
+    model.load_state_dict(torch.load(path, map_location=device))
+    return model.to(device).eval()
+
+
+def request_latency(model: NewsLSTM, batch: int, seq_len: int, repeat: int) -> float:
+    # batch=1 — /predict, batch=seq_len+1 — leave-one-out /explain
+    model = model.cpu().eval()
+    text = torch.randn(batch, seq_len, EMBED_DIM) * 0.1
+    lengths = torch.full((batch,), seq_len, dtype=torch.long)
+    numeric = torch.randn(batch, NUMERIC_DIM)
+    timings = []
+    with torch.no_grad():
+        model(text, lengths, numeric)
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            model(text, lengths, numeric)
+            timings.append(time.perf_counter() - t0)
+    return float(np.median(timings))
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Дистилляция NewsLSTM в маленького студента.")
+    p.add_argument("--train", type=Path, default=DEFAULT_TRAIN)
+    p.add_argument("--val", type=Path, default=DEFAULT_VAL)
+    p.add_argument("--test", type=Path, default=DEFAULT_TEST)
+    p.add_argument("--w2v", type=Path, default=DEFAULT_W2V)
+    p.add_argument("--teacher", type=Path, default=DEFAULT_TEACHER)
+    p.add_argument("--teacher-hidden-size", type=int, default=256)
+    p.add_argument("--scaler", type=Path, default=DEFAULT_SCALER)
+    p.add_argument("--out", type=Path, default=DEFAULT_OUT)
+    p.add_argument("--hidden-size", type=int, default=64)
+    p.add_argument("--dropout", type=float, default=0.1)
+    p.add_argument(
+        "--alpha", type=float, default=0.8,
+        help="вес MSE к выходу учителя; 1 − alpha — к истинному таргету",
+    )
+    p.add_argument("--epochs", type=int, default=50)
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--lr", type=float, default=1e-3)
+    p.add_argument("--patience", type=int, default=5)
+    p.add_argument("--seq-len", type=int, default=50, help="длина окна для замера латентности")
+    p.add_argument("--device", default=None, help="cpu / cuda / mps, иначе auto")
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    device = pick_device(args.device)
+    print(f"Device: {device}\n")
+
+    kv = KeyedVectors.load(str(args.w2v))
+    # скейлер учителя: студент обслуживается с тем же lstm_scaler.pkl
+    with args.scaler.open("rb") as f:
+        fit_state = pickle.load(f)
+    train_ds = NewsLSTMDataset(args.train, kv, fit_state=fit_state)
+    val_ds = NewsLSTMDataset(args.val, kv, fit_state=fit_state)
+    test_ds = NewsLSTMDataset(args.test, kv, fit_state=fit_state)
+    print(f"Сплиты: train={len(train_ds)}, val={len(val_ds)}, test={len(test_ds)}\n")
+
+    teacher = load_model(args.teacher, args.teacher_hidden_size, device)
+    train_plain = DataLoader(train_ds, batch_size=256, shuffle=False, collate_fn=collate)
+    teacher_train, _ = predict(teacher, train_plain, device)
+    print(f"Выход учителя на train посчитан: {len(teacher_train)} окон\n")
+
+    train_loader = DataLoader(
+        DistillDataset(train_ds, teacher_train),
+        batch_size=args.batch_size, shuffle=True, collate_fn=collate_distill,
+    )
+    val_loader = DataLoader(val_ds, batch_size=args.batch_size, shuffle=False, collate_fn=collate)
+    test_loader = DataLoader(test_ds, batch_size=args.batch_size, shuffle=False, collate_fn=collate)
+
+    student = NewsLSTM(
+        embed_dim=EMBED_DIM,
+        hidden_size=args.hidden_size,
+        num_layers=1,
+        num_numeric=NUMERIC_DIM,
+        dropout=args.dropout,
+    ).to(device)
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.lr)
+    loss_fn = torch.nn.MSELoss()
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    best_val_mse = float("inf")
+    patience_left = args.patience
+    for epoch in range(1, args.epochs + 1):
+        t0 = time.time()
+        student.train()
+        losses = []
+        for text_emb, lengths, numeric, target, soft in train_loader:
+            text_emb, numeric = text_emb.to(device), numeric.to(device)
+            target, soft = target.to(device), soft.to(device)
+            optimizer.zero_grad()
+            pred = student(text_emb, lengths, numeric)
+            loss = args.alpha * loss_fn(pred, soft) + (1 - args.alpha) * loss_fn(pred, target)
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+
+        val_pred, val_true = predict(student, val_loader, device)
+        val_m = evaluate(val_true, val_pred)
+        print(
+            f"epoch {epoch:3d}  distill_loss={np.mean(losses):.3e}  "
+            f"val_mse={val_m['mse']:.3e}  val_dir={val_m['dir_acc']:.1%}  ({time.time() - t0:.1f}s)"
+        )
+        if val_m["mse"] < best_val_mse - 1e-12:
+            best_val_mse = val_m["mse"]
+            patience_left = args.patience
+            torch.save(student.state_dict(), args.out)
+        else:
+            patience_left -= 1
+            if patience_left <= 0:
+                print(f"\nEarly stopping на эпохе {epoch} (patience exhausted)")
+                break
+
+    student.load_state_dict(torch.load(args.out, map_location=device))
+    teacher_pred, test_true = predict(teacher, test_loader, device)
+    student_pred, _ = predict(student, test_loader, device)
+    teacher_m = evaluate(test_true, teacher_pred)
+    student_m = evaluate(test_true, student_pred)
+    print("\n=== Test: учитель vs студент ===")
+    print(format_metrics("teach", teacher_m))
+    print(format_metrics("stud", student_m))
+    print(f"max|Δy_pred| student−teacher: {np.abs(student_pred - teacher_pred).max() * 100:.5f}%")
+
+    latency = {}
+    print(f"\n=== Латентность на запрос (CPU, окно {args.seq_len} новостей) ===")
+    for name, batch in (("predict", 1), ("explain", args.seq_len + 1)):
+        t_teacher = request_latency(teacher, batch, args.seq_len, repeat=20)
+        t_student = request_latency(student, batch, args.seq_len, repeat=20)
+        latency[name] = {"teacher_ms": t_teacher * 1e3, "student_ms": t_student * 1e3}
+        print(
+            f"{name:8s} teacher: {t_teacher * 1e3:7.2f} ms  "
+            f"student: {t_student * 1e3:7.2f} ms  ×{t_teacher / t_student:4.1f}"
+        )
+
+    meta = {
+        "hidden_size": args.hidden_size,
+        "num_layers": 1,
+        "dropout": args.dropout,
+        "teacher": str(args.teacher),
+        "alpha": args.alpha,
+        "scaler": str(args.scaler),
+        "test": {"teacher": teacher_m, "student": student_m},
+        "latency": latency,
+    }
+    meta_path = args.out.with_suffix(".json")
+    meta_path.write_text(json.dumps(meta, indent=2, ensure_ascii=False))
+    print(f"\nСтудент: {args.out}, метаданные: {meta_path}")
+
+
+if __name__ == "__main__":
+    main()
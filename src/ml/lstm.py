@@ -43,3 +43,11 @@ class NewsLSTM(nn.Module):
             h_t[nonempty] = h_n[-1]
         h_t = self.head_dropout(h_t)
         return self.head(torch.cat([h_t, numeric], dim=1)).squeeze(-1)
+
+
+def quantize_dynamic_int8(model: NewsLSTM) -> NewsLSTM:
+    # Динамическое int8: веса LSTM и головы квантуются заранее, активации — на лету.
+    # Только CPU; атрибуты модели (hidden_size, num_layers, lstm, head) остаются.
+    return torch.ao.quantization.quantize_dynamic(
+        model.cpu().eval(), {nn.LSTM, nn.Linear}, dtype=torch.qint8,
+    )
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+
+def _sigmoid(x: np.ndarray, out: np.ndarray) -> np.ndarray:
+    np.negative(x, out=out)
+    np.exp(out, out=out)
+    out += 1.0
+    return np.reciprocal(out, out=out)
+
+
+class NumpyNewsLSTM:
+    # Инференс однослойного NewsLSTM на NumPy: те же веса, та же рекуррентность,
+    # что у nn.LSTM (гейты i, f, g, o), + линейная голова. Без autograd и пулов
+    # потоков torch; буферы гейтов переиспользуются между вызовами — свои в каждом
+    # потоке (predict и explain в воркере считают на одной модели параллельно).
+    def __init__(
+        self,
+        w_ih: np.ndarray,
+        w_hh: np.ndarray,
+        bias: np.ndarray,
+        head_w: np.ndarray,
+        head_b: float,
+    ) -> None:
+        self.hidden_size = w_hh.shape[1]
+        self.num_layers = 1
+        self.w_ih_t = np.ascontiguousarray(w_ih.T, dtype=np.float32)  # (E, 4H)
+        self.w_hh_t = np.ascontiguousarray(w_hh.T, dtype=np.float32)  # (H, 4H)
+        self.bias = np.ascontiguousarray(bias, dtype=np.float32)
+        self.head_w_h = np.ascontiguousarray(head_w[: self.hidden_size], dtype=np.float32)
+        self.head_w_num = np.ascontiguousarray(head_w[self.hidden_size:], dtype=np.float32)
+        self.head_b = np.float32(head_b)
+        self._buffers = threading.local()
+
+    @classmethod
+    def from_state_dict(cls, state: Mapping[str, object]) -> NumpyNewsLSTM:
+        arrays = {k: np.asarray(v, dtype=np.float32) for k, v in state.items()}
+        if "lstm.weight_ih_l1" in arrays:
+            raise ValueError("NumPy-движок поддерживает только однослойный NewsLSTM")
+        return cls(
+            w_ih=arrays["lstm.weight_ih_l0"],
+            w_hh=arrays["lstm.weight_hh_l0"],
+            bias=arrays["lstm.bias_ih_l0"] + arrays["lstm.bias_hh_l0"],
+            head_w=arrays["head.weight"].reshape(-1),
+            head_b=float(arrays["head.bias"].reshape(-1)[0]),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> NumpyNewsLSTM:
+        # .npz — без torch; .pt — через torch.load (только при конвертации)
+        if path.suffix == ".npz":
+            with np.load(path) as data:
+                return cls.from_state_dict({k: data[k] for k in data.files})
+        import torch
+
+        state = torch.load(path, map_location="cpu")
+        return cls.from_state_dict({k: v.numpy() for k, v in state.items()})
+
+    def _gate_buffers(self, batch: int) -> tuple[np.ndarray, np.ndarray]:
+        # растут только вверх; каждый шаг работает с префиксом [:m]
+        buffers = self._buffers
+        gates = getattr(buffers, "gates", None)
+        if gates is None or gates.shape[0] < batch:
+            buffers.gates = np.empty((batch, 4 * self.hidden_size), dtype=np.float32)
+            buffers.tmp = np.empty_like(buffers.gates)
+        return buffers.gates, buffers.tmp
+
+    def run(
+        self,
+        x: np.ndarray,
+        lengths: np.ndarray,
+        h0: np.ndarray | None = None,
+        c0: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # x — (B, T, E) с паддингом; возвращает (h, c) после lengths[b] шагов,
+        # для lengths[b] == 0 — исходное состояние.
+        B = x.shape[0]
+        H = self.hidden_size
+        h = np.zeros((B, H), dtype=np.float32) if h0 is None else h0.astype(np.float32)
+        c = np.zeros((B, H), dtype=np.float32) if c0 is None else c0.astype(np.float32)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if B == 0 or lengths.max(initial=0) == 0:
+            return h, c
+
+        # по убыванию длины: на шаге t активен префикс из документов длиннее t
+        order = np.argsort(-lengths, kind="stable")
+        sorted_len = lengths[order]
+        T = int(sorted_len[0])
+        h_s, c_s = h[order], c[order]
+        # входная проекция всех шагов одним matmul
+        x_proj = x[order, :T].astype(np.float32, copy=False) @ self.w_ih_t
+        x_proj += self.bias
+        gates_all, tmp_all = self._gate_buffers(B)
+        active = B - np.searchsorted(sorted_len[::-1], np.arange(T), side="right")
+        with np.errstate(over="ignore"):  # exp(-x) → inf даёт корректный sigmoid = 0
+            self._steps(x_proj, active, h_s, c_s, gates_all, tmp_all)
+        h[order], c[order] = h_s, c_s
+        return h, c
+
+    def _steps(
+        self,
+        x_proj: np.ndarray,
+        active: np.ndarray,
+        h_s: np.ndarray,
+        c_s: np.ndarray,
+        gates_all: np.ndarray,
+        tmp_all: np.ndarray,
+    ) -> None:
+        H = self.hidden_size
+        for t, m in enumerate(active):
+            gates, tmp = gates_all[:m], tmp_all[:m]
+            np.matmul(h_s[:m], self.w_hh_t, out=gates)
+            gates += x_proj[:m, t]
+            i = _sigmoid(gates[:, :H], tmp[:, :H])
+            f = _sigmoid(gates[:, H:2 * H], tmp[:, H:2 * H])
+            g = np.tanh(gates[:, 2 * H:3 * H], out=tmp[:, 2 * H:3 * H])
+            o = _sigmoid(gates[:, 3 * H:], tmp[:, 3 * H:])
+            c_m = c_s[:m]
+            c_m *= f
+            c_m += i * g
+            np.tanh(c_m, out=h_s[:m])
+            h_s[:m] *= o
+
+    def head(self, h: np.ndarray, numeric: np.ndarray) -> np.ndarray:
+        return h @ self.head_w_h + numeric.astype(np.float32) @ self.head_w_num + self.head_b
+
+    def head_no_news(self, numeric: np.ndarray) -> np.ndarray:
+        # нет новостей → h_t = 0, остаётся только голова по числовым признакам
+        return numeric.astype(np.float32) @ self.head_w_num + self.head_b
+
+    def __call__(
+        self, text_emb: np.ndarray, lengths: np.ndarray, numeric: np.ndarray,
+    ) -> np.ndarray:
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if lengths.max(initial=0) == 0:
+            return self.head_no_news(numeric)
+        h, _ = self.run(text_emb, lengths)
+        return self.head(h, numeric)
+
+
+def export_npz(pt_path: Path, npz_path: Path) -> None:
+    import torch
+
+    state = torch.load(pt_path, map_location="cpu")
+    np.savez(npz_path, **{k: v.numpy() for k, v in state.items()})
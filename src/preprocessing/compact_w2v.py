@@ -0,0 +1,105 @@
+import argparse
+import pickle
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from gensim.models import KeyedVectors
+from torch.utils.data import DataLoader
+
+from src.ml.dataset import EMBED_DIM, NUMERIC_DIM, NewsLSTMDataset, collate
+from src.ml.lstm import NewsLSTM
+from src.ml.train_lstm import predict
+
+DEFAULT_W2V = Path("models/word2vec.kv")
+DEFAULT_CORPUS = Path("data/processed/news_clean.parquet")
+DEFAULT_OUT = Path("models/word2vec_compact.kv")
+DEFAULT_REPLAY = Path("data/processed/test.parquet")
+DEFAULT_LSTM = Path("models/lstm_best.pt")
+DEFAULT_SCALER = Path("models/lstm_scaler.pkl")
+
+
+def recent_counts(corpus: Path, recent_days: int) -> Counter:
+    df = pd.read_parquet(corpus, columns=["ts", "text"])
+    ts = pd.to_datetime(df["ts"])
+    recent = df.loc[ts >= ts.max() - pd.Timedelta(days=recent_days), "text"]
+    counts: Counter = Counter()
+    for text in recent:
+        counts.update(text.split())
+    return counts
+
+
+def compact(kv: KeyedVectors, counts: Counter, min_count: int) -> KeyedVectors:
+    # только токены из словаря, встречавшиеся в свежем корпусе ≥ min_count раз;
+    # частые первыми. Векторы во float16 — в float32 их поднимает embed_token_ids.
+    keys = [tok for tok, n in counts.most_common() if n >= min_count and tok in kv.key_to_index]
+    out = KeyedVectors(kv.vector_size, count=0, dtype=np.float16)
+    out.add_vectors(keys, kv.vectors[[kv.key_to_index[k] for k in keys]].astype(np.float16))
+    return out
+
+
+def replay_preds(kv: KeyedVectors, replay: Path, lstm_path: Path, scaler_path: Path) -> np.ndarray:
+    with scaler_path.open("rb") as f:
+        fit_state = pickle.load(f)
+    model = NewsLSTM(embed_dim=EMBED_DIM, num_numeric=NUMERIC_DIM)
+    model.load_state_dict(torch.load(lstm_path, map_location="cpu"))
+    loader = DataLoader(
+        NewsLSTMDataset(replay, kv, fit_state=fit_state),
+        batch_size=256, shuffle=False, collate_fn=collate,
+    )
+    preds, _ = predict(model, loader, torch.device("cpu"))
+    return preds
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description="Компактный W2V для инференса: словарь свежего корпуса, float16."
+    )
+    p.add_argument("--w2v", type=Path, default=DEFAULT_W2V)
+    p.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    p.add_argument("--out", type=Path, default=DEFAULT_OUT)
+    p.add_argument("--recent-days", type=int, default=180)
+    p.add_argument("--min-count", type=int, default=2)
+    p.add_argument("--replay", type=Path, default=DEFAULT_REPLAY)
+    p.add_argument("--lstm", type=Path, default=DEFAULT_LSTM)
+    p.add_argument("--scaler", type=Path, default=DEFAULT_SCALER)
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    print(f"Загружаю W2V: {args.w2v}")
+    kv = KeyedVectors.load(str(args.w2v))
+    print(f"Считаю частоты за последние {args.recent_days} дн. корпуса {args.corpus}…")
+    counts = recent_counts(args.corpus, args.recent_days)
+    small = compact(kv, counts, args.min_count)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    # векторы всегда отдельным .npy — чтобы load_kv мог их замапить
+    small.save(str(args.out), separately=["vectors"])
+
+    before, after = kv.vectors.nbytes, small.vectors.nbytes
+    print(f"\nСохранено: {args.out}")
+    print(f"  словарь: {len(kv):,} → {len(small):,} ({len(small) / len(kv):.1%})")
+    print(
+        f"  матрица: {before / 2**20:.1f}MB → {after / 2**20:.1f}MB "
+        f"(−{(before - after) / 2**20:.1f}MB)"
+    )
+
+    if not (args.replay.exists() and args.lstm.exists() and args.scaler.exists()):
+        print(f"\nReplay пропущен: нет {args.replay}, {args.lstm} или {args.scaler}")
+        return
+    print(f"\nReplay {args.replay}: полный vs компактный словарь…")
+    full = replay_preds(kv, args.replay, args.lstm, args.scaler)
+    comp = replay_preds(small, args.replay, args.lstm, args.scaler)
+    delta = np.abs(full - comp)
+    print(f"  точек: {len(full):,}")
+    print(f"  |Δy_pred|: mean={delta.mean() * 100:.5f}%  max={delta.max() * 100:.5f}% (п.п.)")
+    print(f"  совпадение знака: {np.mean(np.sign(full) == np.sign(comp)):.2%}")
+
+
+if __name__ == "__main__":
+    main()
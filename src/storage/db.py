@@ -5,13 +5,21 @@ from contextlib import contextmanager
 from datetime import datetime
 from typing import Any
 
-from sqlalchemy import create_engine, delete, func, select
+from sqlalchemy import create_engine, delete, func, inspect, select, text
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session, sessionmaker
 
 from src.config import settings
-from src.storage.models import Base, Candle, News, Notification, Prediction, Subscription
+from src.storage.models import (
+    Base,
+    Candle,
+    News,
+    NewsFeature,
+    Notification,
+    Prediction,
+    Subscription,
+)
 
 _engine: Engine | None = None
 _SessionLocal: sessionmaker[Session] | None = None
@@ -26,7 +34,28 @@ def get_engine() -> Engine:
 
 
 def init_schema() -> None:
-    Base.metadata.create_all(get_engine())
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    _add_missing_columns(engine)
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    # create_all не трогает существующие таблицы: новые nullable-колонки моделей
+    # дописываем ALTER TABLE ADD COLUMN, остальное — руками. IF NOT EXISTS — init_schema
+    # одновременно зовут API, ingest и воркер: колонку мог добавить другой процесс
+    inspector = inspect(engine)
+    prep = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    conn.execute(text(
+                        f"ALTER TABLE {prep.format_table(table)} ADD COLUMN IF NOT EXISTS "
+                        f"{prep.format_column(column)} {column.type.compile(engine.dialect)}"
+                    ))
 
 
 @contextmanager
@@ -50,21 +79,48 @@ def _parse_dt(dt: str | datetime) -> datetime:
     return datetime.fromisoformat(dt)
 
 
+_PREDICTION_FIELDS = [
+    "y_pred", "n_news", "ret_1", "ret_60", "ret_120", "ner_org_weight_sum_mean",
+    "ner_has_top_company_any", "n_news_window_total", "market_status", "model_version",
+]
+_UPSERT_COLUMNS = ["dt", *_PREDICTION_FIELDS, "window_start", "window_end"]
+# у psycopg не больше 65535 параметров на запрос — режем multi-row INSERT по строкам
+UPSERT_MAX_ROWS = 65535 // len(_UPSERT_COLUMNS)
+
+
+def upsert_predictions(session: Session, payloads: list[dict[str, Any]]) -> None:
+    # multi-row INSERT ... ON CONFLICT (dt) DO UPDATE, по UPSERT_MAX_ROWS строк на запрос
+    if not payloads:
+        return
+    rows = [
+        {
+            "dt": _parse_dt(p["dt"]),
+            **{k: p.get(k) for k in _PREDICTION_FIELDS},
+            "window_start": _parse_dt(p["window_start"]) if p.get("window_start") else None,
+            "window_end": _parse_dt(p["window_end"]) if p.get("window_end") else None,
+        }
+        for p in payloads
+    ]
+    for i in range(0, len(rows), UPSERT_MAX_ROWS):
+        stmt = pg_insert(Prediction).values(rows[i:i + UPSERT_MAX_ROWS])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["dt"],
+            set_={k: stmt.excluded[k] for k in _UPSERT_COLUMNS if k != "dt"},
+        )
+        session.execute(stmt)
+
+
 def save_prediction(session: Session, payload: dict[str, Any]) -> None:
-    dt = _parse_dt(payload["dt"])
-    existing = session.execute(
-        select(Prediction).where(Prediction.dt == dt)
-    ).scalar_one_or_none()
-    if existing is None:
-        existing = Prediction(dt=dt)
-        session.add(existing)
-    existing.y_pred = float(payload["y_pred"])
-    existing.n_news = int(payload["n_news"])
-    existing.ret_1 = payload.get("ret_1")
-    existing.ret_60 = payload.get("ret_60")
-    existing.ret_120 = payload.get("ret_120")
-    existing.ner_org_weight_sum_mean = payload.get("ner_org_weight_sum_mean")
-    existing.ner_has_top_company_any = bool(payload.get("ner_has_top_company_any"))
+    upsert_predictions(session, [payload])
+
+
+def prediction_dts(
+    session: Session, start: datetime, end: datetime, model_version: str | None = None,
+) -> set[datetime]:
+    stmt = select(Prediction.dt).where(Prediction.dt >= start, Prediction.dt <= end)
+    if model_version is not None:
+        stmt = stmt.where(Prediction.model_version == model_version)
+    return set(session.execute(stmt).scalars().all())
 
 
 def recent_predictions(session: Session, limit: int) -> list[dict[str, Any]]:
@@ -82,6 +138,35 @@ def recent_predictions(session: Session, limit: int) -> list[dict[str, Any]]:
     ]
 
 
+def recent_prediction_payloads(session: Session, limit: int) -> list[dict[str, Any]]:
+    # полные payload'ы /predict (строки, сохранённые до появления колонок окна, пропускаем)
+    rows = session.execute(
+        select(Prediction)
+        .where(Prediction.window_start.is_not(None))
+        .order_by(Prediction.dt.desc())
+        .limit(limit)
+    ).scalars().all()
+    return [
+        {
+            "dt": r.dt.isoformat(sep="T"),
+            "y_pred": r.y_pred,
+            "y_pred_pct": r.y_pred * 100,
+            "n_news": r.n_news,
+            "n_news_window_total": r.n_news_window_total,
+            "ret_1": r.ret_1,
+            "ret_60": r.ret_60,
+            "ret_120": r.ret_120,
+            "ner_org_weight_sum_mean": r.ner_org_weight_sum_mean,
+            "ner_has_top_company_any": r.ner_has_top_company_any,
+            "market_status": r.market_status,
+            "window_start": r.window_start.isoformat(),
+            "window_end": r.window_end.isoformat(),
+            "model_version": r.model_version,
+        }
+        for r in rows
+    ]
+
+
 def prediction_by_dt(session: Session, dt: datetime) -> dict[str, Any] | None:
     row = session.execute(
         select(Prediction).where(Prediction.dt == dt)
@@ -96,6 +181,27 @@ def prediction_by_dt(session: Session, dt: datetime) -> dict[str, Any] | None:
     }
 
 
+def predictions_by_dts(session: Session, dts: list[datetime]) -> dict[datetime, dict[str, Any]]:
+    # один SELECT ... WHERE dt IN (...) вместо prediction_by_dt на каждый dt
+    if not dts:
+        return {}
+    rows = session.execute(
+        select(Prediction).where(Prediction.dt.in_(dts))
+    ).scalars().all()
+    return {
+        r.dt: {
+            "dt": r.dt.isoformat(sep="T"),
+            "y_pred": r.y_pred,
+            "n_news": r.n_news,
+            "ner_has_top_company_any": int(r.ner_has_top_company_any),
+            "window_start": r.window_start,
+            "window_end": r.window_end,
+            "model_version": r.model_version,
+        }
+        for r in rows
+    }
+
+
 def upsert_subscription(session: Session, chat_id: int, threshold_pct: float) -> None:
     sub = session.get(Subscription, chat_id)
     if sub is None:
@@ -157,3 +263,29 @@ def insert_news(session: Session, rows: list[dict[str, Any]]) -> int:
     stmt = stmt.on_conflict_do_nothing(index_elements=["source", "source_id"]).returning(News.id)
     inserted_ids = session.execute(stmt).scalars().all()
     return len(inserted_ids)
+
+
+def news_missing_features(
+    session: Session, version: str, since: datetime, limit: int,
+) -> list[dict[str, Any]]:
+    rows = session.execute(
+        select(News.id, News.ts, News.title, News.body)
+        .outerjoin(
+            NewsFeature,
+            (NewsFeature.news_id == News.id) & (NewsFeature.version == version),
+        )
+        .where(News.ts >= since, NewsFeature.news_id.is_(None))
+        .order_by(News.ts.desc())
+        .limit(limit)
+    ).all()
+    return [{"id": r.id, "ts": r.ts, "title": r.title, "body": r.body} for r in rows]
+
+
+def save_news_features(session: Session, rows: list[dict[str, Any]]) -> int:
+    if not rows:
+        return 0
+    stmt = pg_insert(NewsFeature).values(rows)
+    stmt = stmt.on_conflict_do_nothing(
+        index_elements=["news_id", "version"]
+    ).returning(NewsFeature.news_id)
+    return len(session.execute(stmt).scalars().all())
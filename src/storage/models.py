@@ -7,8 +7,10 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     Float,
+    ForeignKey,
     Index,
     Integer,
+    LargeBinary,
     String,
     Text,
     UniqueConstraint,
@@ -48,6 +50,33 @@ class News(Base):
     )
 
 
+class NewsFeature(Base):
+    __tablename__ = "news_features"
+
+    news_id: Mapped[int] = mapped_column(
+        BigIntAuto,
+        ForeignKey("news.id", ondelete="CASCADE"),
+        primary_key=True,
+        autoincrement=False,
+    )
+    version: Mapped[str] = mapped_column(String(32), primary_key=True)
+    ts: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    cleaned: Mapped[str] = mapped_column(Text, nullable=False)
+    display: Mapped[str] = mapped_column(String(160), nullable=False)
+    tickers: Mapped[str] = mapped_column(String(256), nullable=False, default="")
+    org_weight: Mapped[float] = mapped_column(Float, nullable=False)
+    n_components: Mapped[int] = mapped_column(Integer, nullable=False)
+    has_top: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    # int32 / float32 массивы как bytes (np.frombuffer на чтении)
+    token_ids: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    embedding: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, server_default=func.now(), nullable=False,
+    )
+
+    __table_args__ = (Index("ix_news_features_version_ts", "version", "ts"),)
+
+
 class Prediction(Base):
     __tablename__ = "predictions"
 
@@ -60,6 +89,12 @@ class Prediction(Base):
     ret_120: Mapped[float | None] = mapped_column(Float)
     ner_org_weight_sum_mean: Mapped[float | None] = mapped_column(Float)
     ner_has_top_company_any: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    # остаток payload /predict — чтобы прогрев Redis из БД отдавал полный ответ
+    n_news_window_total: Mapped[int | None] = mapped_column(Integer)
+    market_status: Mapped[str | None] = mapped_column(String(16))
+    window_start: Mapped[datetime | None] = mapped_column(DateTime)
+    window_end: Mapped[datetime | None] = mapped_column(DateTime)
+    model_version: Mapped[str | None] = mapped_column(String(32))
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
 
 
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any
+
+from src.config import settings
+from src.storage.db import session_scope, upsert_predictions
+
+logger = logging.getLogger("storage.writer")
+
+
+class PredictionWriter:
+    # Write-behind для таблицы predictions: add() только кладёт payload в буфер,
+    # фоновый поток сбрасывает его одним upsert_predictions, как только набралось
+    # batch_size прогнозов или прошло flush_sec с первого несброшенного.
+    # Буфер ключуется по dt — повторный прогноз того же часа заменяет прежний
+    # (и в одном INSERT ... ON CONFLICT не бывает двух строк с одним dt).
+    def __init__(self, batch_size: int | None = None, flush_sec: float | None = None) -> None:
+        self._batch_size = max(1, batch_size or settings.persist_batch_size)
+        self._flush_sec = flush_sec if flush_sec is not None else settings.persist_flush_sec
+        self._buffer: dict[str, dict[str, Any]] = {}
+        self._first_at: float | None = None
+        self._retry_at = 0.0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="prediction-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, payloads: list[dict[str, Any]]) -> None:
+        if not payloads:
+            return
+        with self._cond:
+            for payload in payloads:
+                self._buffer[payload["dt"]] = payload
+            if self._first_at is None:
+                # поток спит без таймаута, пока буфер пуст, — будим, чтобы он
+                # пересчитал срок сброса по flush_sec
+                self._first_at = time.monotonic()
+                self._cond.notify()
+            elif len(self._buffer) >= self._batch_size:
+                self._cond.notify()
+
+    def close(self) -> None:
+        # остановка сервиса: фоновый поток сбрасывает остаток и выходит
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(timeout=30)
+        if self._buffer:
+            logger.warning("writer: при остановке не записано прогнозов: %d", len(self._buffer))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stop and not self._due():
+                    timeout = None
+                    if self._first_at is not None:
+                        wake = max(self._first_at + self._flush_sec, self._retry_at)
+                        timeout = max(0.0, wake - time.monotonic())
+                    self._cond.wait(timeout)
+                stop = self._stop
+                batch, self._buffer, self._first_at = self._buffer, {}, None
+            self._flush(batch)
+            if stop:
+                return
+
+    def _due(self) -> bool:
+        if self._first_at is None or time.monotonic() < self._retry_at:
+            return False
+        return (
+            len(self._buffer) >= self._batch_size
+            or time.monotonic() - self._first_at >= self._flush_sec
+        )
+
+    def _flush(self, batch: dict[str, dict[str, Any]]) -> None:
+        if not batch:
+            return
+        t0 = time.perf_counter()
+        try:
+            with session_scope() as session:
+                upsert_predictions(session, list(batch.values()))
+        except Exception as exc:
+            # Postgres недоступен — вернём пачку в буфер (свежие payload'ы приоритетнее)
+            # и попробуем на следующем сбросе
+            logger.warning("writer: upsert %d прогнозов не удался: %s", len(batch), exc)
+            with self._cond:
+                self._buffer = {**batch, **self._buffer}
+                self._first_at = time.monotonic()
+                self._retry_at = self._first_at + self._flush_sec
+            return
+        logger.info(
+            "writer: upsert %d прогнозов за %.1f ms", len(batch), (time.perf_counter() - t0) * 1e3,
+        )
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from src.api import main
+
+
+class _HeldClaimCache:
+    # claim держит другая реплика; после released_after опросов она его снимает,
+    # не записав результата (воркер ответил ошибкой или не ответил)
+    def __init__(self, released_after: int) -> None:
+        self._polls = 0
+        self._released_after = released_after
+        self.claims = 0
+
+    def get(self, key: str) -> None:
+        return None
+
+    def claimed(self, name: str) -> bool:
+        self._polls += 1
+        return self._polls < self._released_after
+
+    def claim(self, name: str, ttl_sec: int) -> str | None:
+        self.claims += 1
+        return None if self.claims == 1 else "token"
+
+    def release(self, name: str, token: str) -> None:
+        pass
+
+
+def test_dispatch_stops_waiting_when_claim_released(monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = _HeldClaimCache(released_after=3)
+    published: list[str] = []
+
+    async def publish_and_wait(dt_iso: str) -> dict:
+        published.append(dt_iso)
+        return {"dt": dt_iso}
+
+    monkeypatch.setattr(main, "state", {"cache": cache})
+    monkeypatch.setattr(main, "POLL_INTERVAL_SEC", 0.01)
+    monkeypatch.setattr(main, "_publish_and_wait", publish_and_wait)
+
+    t0 = time.monotonic()
+    result = asyncio.run(main._dispatch("2024-05-06T11:00:00", "key"))
+
+    assert result == {"dt": "2024-05-06T11:00:00"}
+    assert published == ["2024-05-06T11:00:00"]
+    assert cache.claims == 2
+    assert time.monotonic() - t0 < 1.0
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from src.api import main
+from src.inference import queue as queue_module
+
+DT = "2024-05-06T11:00:00"
+PAYLOAD = {
+    "dt": DT,
+    "y_pred": 0.001,
+    "y_pred_pct": 0.1,
+    "n_news": 3,
+    "n_news_window_total": 5,
+    "ret_1": 0.0,
+    "ret_60": 0.0,
+    "ret_120": 0.0,
+    "ner_org_weight_sum_mean": 0.5,
+    "ner_has_top_company_any": True,
+    "market_status": "open",
+    "window_start": "2024-05-06T07:00:00",
+    "window_end": DT,
+    "model_version": "v1",
+}
+
+
+class _MissCache:
+    # кэш без данных: /predict идёт в predict-worker
+    def model_version(self) -> str:
+        return "v1"
+
+    def get(self, key: str) -> None:
+        return None
+
+    def get_stale_many(self, dt_isos: list[str], version: str | None) -> dict:
+        return {}
+
+    def claim(self, name: str, ttl_sec: int) -> str:
+        return "token"
+
+    def release(self, name: str, token: str) -> None:
+        pass
+
+
+class _ReplyingPublisher:
+    # вместо RabbitMQ: запоминает заголовки задачи и сразу отвечает, как воркер
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self.headers: list[dict] = []
+
+    def publish(self, queue: str, body: str, properties) -> Future:
+        self.headers.append(properties.headers)
+        self._loop.call_soon_threadsafe(
+            main._resolve_reply, properties.correlation_id, dict(PAYLOAD),
+        )
+        future: Future = Future()
+        future.set_result(None)
+        return future
+
+
+def test_task_trace_id_matches_response(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(main, "cache_key", lambda t, version: f"{DT}:{version}:1-1")
+
+    async def run() -> tuple[httpx.Response, list[dict]]:
+        publisher = _ReplyingPublisher(asyncio.get_running_loop())
+        monkeypatch.setattr(queue_module, "get_publisher", lambda: publisher)
+        monkeypatch.setattr(main, "state", {
+            "cache": _MissCache(),
+            "model_version": None,
+            "model_version_at": float("-inf"),
+            "inflight": {},
+            "replies": {},
+            "loop": asyncio.get_running_loop(),
+            "listener": SimpleNamespace(queue_name="replies"),
+        })
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+            response = await client.get("/predict", params={"dt": DT})
+        return response, publisher.headers
+
+    response, headers = asyncio.run(run())
+    assert response.status_code == 200
+    assert len(headers) == 1
+    assert headers[0]["trace_id"] == response.headers["X-Trace-Id"]
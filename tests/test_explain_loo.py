@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from src.inference.explain import _leave_one_out
+from src.inference.worker import InferenceArtifacts, forward_batch
+from src.ml.dataset import EMBED_DIM, NUMERIC_DIM
+from src.ml.lstm_numpy import NumpyNewsLSTM
+
+HIDDEN = 16
+TOLERANCE = 1e-5
+
+
+def _artifacts(model, device=None) -> InferenceArtifacts:
+    return InferenceArtifacts(kv=None, model=model, scaler=None, ner=None, device=device)
+
+
+def _numpy_artifacts(rng: np.random.Generator) -> InferenceArtifacts:
+    model = NumpyNewsLSTM(
+        w_ih=rng.standard_normal((4 * HIDDEN, EMBED_DIM)).astype(np.float32) * 0.1,
+        w_hh=rng.standard_normal((4 * HIDDEN, HIDDEN)).astype(np.float32) * 0.1,
+        bias=rng.standard_normal(4 * HIDDEN).astype(np.float32) * 0.1,
+        head_w=rng.standard_normal(HIDDEN + NUMERIC_DIM).astype(np.float32),
+        head_b=0.1,
+    )
+    return _artifacts(model)
+
+
+def _torch_artifacts(rng: np.random.Generator) -> InferenceArtifacts:
+    torch = pytest.importorskip("torch")
+    from src.ml.lstm import NewsLSTM
+
+    torch.manual_seed(int(rng.integers(1 << 31)))
+    model = NewsLSTM(
+        embed_dim=EMBED_DIM, hidden_size=HIDDEN, num_layers=1, num_numeric=NUMERIC_DIM,
+    )
+    return _artifacts(model.eval(), torch.device("cpu"))
+
+
+@pytest.mark.parametrize("make_artifacts", [_numpy_artifacts, _torch_artifacts])
+@pytest.mark.parametrize("n", [1, 2, 7])
+def test_leave_one_out_matches_full_forwards(make_artifacts, n: int) -> None:
+    # [y_base, y_без_0, ..., y_без_{n-1}] с переиспользованием префикса — то же, что
+    # полный прогон без i-й новости; i = n-1 (хвост нулевой длины) и n = 1 — крайние
+    rng = np.random.default_rng(n)
+    artifacts = make_artifacts(rng)
+    news_vecs = rng.standard_normal((n, EMBED_DIM)).astype(np.float32) * 0.1
+    numeric = rng.standard_normal((1, NUMERIC_DIM)).astype(np.float32)
+
+    preds = _leave_one_out(artifacts, news_vecs, numeric)
+
+    seqs = [news_vecs] + [np.delete(news_vecs, i, axis=0) for i in range(n)]
+    expected = forward_batch(artifacts, seqs, np.repeat(numeric, n + 1, axis=0))
+    assert preds.shape == (n + 1,)
+    np.testing.assert_allclose(preds, expected, rtol=0, atol=TOLERANCE)
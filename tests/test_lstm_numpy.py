@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from src.ml.dataset import EMBED_DIM, NUMERIC_DIM
+from src.ml.lstm_numpy import NumpyNewsLSTM
+
+torch = pytest.importorskip("torch")
+
+from src.ml.lstm import NewsLSTM  # noqa: E402
+
+HIDDEN = 32
+TOLERANCE = 1e-6
+
+
+@pytest.fixture(scope="module")
+def models() -> tuple[NewsLSTM, NumpyNewsLSTM]:
+    torch.manual_seed(0)
+    model = NewsLSTM(
+        embed_dim=EMBED_DIM, hidden_size=HIDDEN, num_layers=1, num_numeric=NUMERIC_DIM,
+    ).eval()
+    engine = NumpyNewsLSTM.from_state_dict({k: v.numpy() for k, v in model.state_dict().items()})
+    return model, engine
+
+
+@pytest.mark.parametrize(
+    "lengths",
+    [[0], [1], [7], [5, 5, 5], [0, 3, 1, 12, 0, 7]],
+    ids=["no-news", "one", "single", "batch", "mixed"],
+)
+def test_numpy_matches_torch(models, lengths: list[int]) -> None:
+    # lengths == 0 — закрытая форма head_no_news, остальные — рекуррентность по префиксам
+    model, engine = models
+    rng = np.random.default_rng(len(lengths) * 100 + sum(lengths))
+    lengths_np = np.array(lengths, dtype=np.int64)
+    text = np.zeros((len(lengths), max(1, *lengths), EMBED_DIM), dtype=np.float32)
+    for b, n in enumerate(lengths):
+        text[b, :n] = rng.standard_normal((n, EMBED_DIM)).astype(np.float32) * 0.1
+    numeric = rng.standard_normal((len(lengths), NUMERIC_DIM)).astype(np.float32)
+
+    with torch.no_grad():
+        ref = model(
+            torch.from_numpy(text), torch.from_numpy(lengths_np), torch.from_numpy(numeric),
+        ).numpy()
+    out = engine(text, lengths_np, numeric)
+
+    assert out.shape == ref.shape
+    np.testing.assert_allclose(out, ref, rtol=0, atol=TOLERANCE)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import time
+from contextlib import nullcontext
+
+import pytest
+
+from src.storage import writer as writer_module
+from src.storage.writer import PredictionWriter
+
+
+@pytest.fixture
+def written(monkeypatch: pytest.MonkeyPatch) -> list[list[dict]]:
+    batches: list[list[dict]] = []
+    monkeypatch.setattr(writer_module, "session_scope", nullcontext)
+    monkeypatch.setattr(
+        writer_module, "upsert_predictions", lambda session, payloads: batches.append(payloads),
+    )
+    return batches
+
+
+def _wait_for(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_flush_by_time(written: list[list[dict]]) -> None:
+    writer = PredictionWriter(batch_size=100, flush_sec=0.2)
+    try:
+        writer.add([{"dt": "2024-01-01T10:00:00"}])
+        assert _wait_for(lambda: len(written) == 1)
+        assert [p["dt"] for p in written[0]] == ["2024-01-01T10:00:00"]
+
+        writer.add([{"dt": "2024-01-01T11:00:00"}])
+        assert _wait_for(lambda: len(written) == 2)
+        assert [p["dt"] for p in written[1]] == ["2024-01-01T11:00:00"]
+    finally:
+        writer.close()
+
+
+def test_flush_by_size(written: list[list[dict]]) -> None:
+    writer = PredictionWriter(batch_size=2, flush_sec=60)
+    try:
+        writer.add([{"dt": "2024-01-01T10:00:00"}, {"dt": "2024-01-01T11:00:00"}])
+        assert _wait_for(lambda: len(written) == 1)
+        assert len(written[0]) == 2
+    finally:
+        writer.close()
+
+
+def test_close_flushes_rest(written: list[list[dict]]) -> None:
+    writer = PredictionWriter(batch_size=100, flush_sec=60)
+    writer.add([{"dt": "2024-01-01T10:00:00"}])
+    writer.close()
+    assert [p["dt"] for batch in written for p in batch] == ["2024-01-01T10:00:00"]